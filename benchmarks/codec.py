@@ -0,0 +1,281 @@
+#!/usr/bin/env python3
+"""Micro-benchmarks for the message codec over realistic bundles.
+
+Reports messages per second and the memory blocks/bytes each decoded
+message keeps alive, and compares them against stored baselines:
+
+    python benchmarks/codec.py                # run and compare
+    python benchmarks/codec.py --save         # record a new baseline
+    python benchmarks/codec.py --check        # exit 1 on a regression
+
+Throughput baselines only mean something on the machine that recorded
+them, allocation counts are stable everywhere.
+"""
+
+import argparse
+import gc
+import json
+import os
+import statistics
+import sys
+import time
+import tracemalloc
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+BASELINE = os.path.join(ROOT, 'benchmarks', 'baselines', 'codec.json')
+sys.path.insert(0, os.path.join(ROOT, 'lib', 'python'))
+
+from message import MessageBuffer  # noqa: E402
+from kaillera.game import InputCodec  # noqa: E402
+import kaillera.models as Kaillera  # noqa: E402
+from kaillera.models import (  # noqa: E402
+    KailleraMessage, MessageType, P2PMessage
+)
+import primitives as types  # noqa: E402
+
+
+def server_status(users: int = 200, games: int = 40) -> bytes:
+    data = [b'\0', types.uint(users, 4), types.uint(games, 4)]
+    for id in range(users):
+        data += [types.stringz(f'player{id}'), types.uint(60, 4),
+                 types.uint(1, 1), types.uint(id, 2), types.uint(1, 1)]
+    for id in range(games):
+        data += [types.stringz('Super Smash Bros. (U) [!]'),
+                 types.uint(id, 4), types.stringz('Project64k 0.13'),
+                 types.stringz(f'player{id}'), types.stringz('1/4'),
+                 types.uint(0, 1)]
+
+    buffer = MessageBuffer(manage=True, as_=KailleraMessage)
+    for _ in range(3):
+        buffer.add(Kaillera.ClientAck())
+    buffer.add(KailleraMessage(type_=MessageType.SERVER_STATUS,
+                               data=b''.join(data)))
+    buffer.add(KailleraMessage(type_=MessageType.SERVER_NOTICE,
+                               data=b'Server\0Welcome!\0'))
+    return buffer.encode()
+
+
+def game_data_bundles(frames: int = 60) -> list[bytes]:
+    # every datagram carries the last 5 frames of input
+    buffer = MessageBuffer(manage=True, as_=KailleraMessage, window=5)
+    bundles = []
+    for frame in range(frames):
+        payload = frame.to_bytes(2, 'little') * 4
+        buffer.add(KailleraMessage(type_=MessageType.GAME_DATA, data=b''.join(
+            [b'\0', types.uint(len(payload), 2), payload])))
+        bundles.append(buffer.encode())
+    return bundles
+
+
+def p2p_chat_bundles(lines: int = 7) -> list[bytes]:
+    buffer = MessageBuffer(manage=True, as_=P2PMessage, meta_size=2,
+                           window=5)
+    bundles = []
+    for line in range(lines):
+        buffer.add(Kaillera.P2PChat(f'chat line {line} from the bot'))
+        bundles.append(buffer.encode())
+    return bundles
+
+
+def decode_status():
+    stream = server_status()
+
+    def run():
+        for message in MessageBuffer(stream, as_=KailleraMessage):
+            message.data
+    return run, stream[0]
+
+
+def decode_game_data():
+    bundles = game_data_bundles()
+    count = sum(b[0] for b in bundles)
+
+    def run():
+        server = MessageBuffer(as_=KailleraMessage, window=64)
+        for bundle in bundles:
+            for message in reversed(MessageBuffer(bundle,
+                                                  as_=KailleraMessage)):
+                server.add(message)
+    return run, count
+
+
+def encode_game_data():
+    frames = 60
+
+    def run():
+        buffer = MessageBuffer(manage=True, as_=KailleraMessage, window=5)
+        for frame in range(frames):
+            buffer.add(KailleraMessage(type_=MessageType.GAME_DATA,
+                                       data=b'\0\x08\0' + b'\0' * 8))
+            buffer.encode()
+    return run, frames
+
+
+def encode_cached_input():
+    # a held button repeats its input, so most frames hit the cache
+    frames = 60
+    inputs = [(frame // 6 % 12).to_bytes(2, 'little') * 4
+              for frame in range(frames)]
+
+    def run():
+        codec = InputCodec()
+        buffer = MessageBuffer(manage=True, as_=KailleraMessage, window=5)
+        for data in inputs:
+            buffer.add(codec.encode(data))
+            buffer.encode()
+    return run, frames
+
+
+def decode_p2p_chat():
+    bundles = p2p_chat_bundles()
+    count = sum(b[0] for b in bundles)
+
+    def run():
+        for bundle in bundles:
+            for message in MessageBuffer(bundle, as_=P2PMessage,
+                                         meta_size=2):
+                message.data
+    return run, count
+
+
+def encode_p2p_chat():
+    lines = 7
+
+    def run():
+        buffer = MessageBuffer(manage=True, as_=P2PMessage, meta_size=2,
+                               window=5)
+        for line in range(lines):
+            buffer.add(Kaillera.P2PChat(f'chat line {line} from the bot'))
+            buffer.encode()
+    return run, lines
+
+
+SCENARIOS = {
+    'decode_server_status': decode_status,
+    'decode_game_data': decode_game_data,
+    'encode_game_data': encode_game_data,
+    'encode_cached_input': encode_cached_input,
+    'decode_p2p_chat': decode_p2p_chat,
+    'encode_p2p_chat': encode_p2p_chat,
+}
+
+
+def throughput(run, messages: int, seconds: float, repeat: int) -> float:
+    # calibrate so one sample takes roughly `seconds`, the median sample
+    # holds still on a busy machine where the best one doesn't
+    loops = 1
+    while True:
+        start = time.perf_counter()
+        for _ in range(loops):
+            run()
+        elapsed = time.perf_counter() - start
+        if elapsed >= seconds / 10:
+            break
+        loops *= 2
+
+    loops = max(int(loops * seconds / max(elapsed, 1e-9) / repeat), 1)
+    samples = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        for _ in range(loops):
+            run()
+        samples.append(time.perf_counter() - start)
+    return messages * loops / statistics.median(samples)
+
+
+def retained(stream: bytes, as_: type, meta_size: int,
+             samples: int = 200) -> tuple[float, float]:
+    # blocks and bytes each decoded message keeps alive
+    gc.collect()
+    tracemalloc.start()
+    before = tracemalloc.take_snapshot()
+
+    kept = []
+    for _ in range(samples):
+        kept.append(MessageBuffer(stream, as_=as_, meta_size=meta_size))
+
+    after = tracemalloc.take_snapshot()
+    tracemalloc.stop()
+
+    stats = after.compare_to(before, 'filename')
+    blocks = sum(s.count_diff for s in stats)
+    size = sum(s.size_diff for s in stats)
+    messages = samples * stream[0]
+    return blocks / messages, size / messages
+
+
+def measure(seconds: float, repeat: int) -> dict:
+    results = {}
+    for name, scenario in SCENARIOS.items():
+        run, messages = scenario()
+        results[name] = {'msgs_per_sec': round(
+            throughput(run, messages, seconds, repeat))}
+
+    allocations = {
+        'decode_server_status': (server_status(), KailleraMessage, 4),
+        'decode_game_data': (game_data_bundles()[-1], KailleraMessage, 4),
+        'decode_p2p_chat': (p2p_chat_bundles()[-1], P2PMessage, 2),
+    }
+    for name, args in allocations.items():
+        blocks, size = retained(*args)
+        results[name]['blocks_per_msg'] = round(blocks, 2)
+        results[name]['bytes_per_msg'] = round(size, 1)
+    return results
+
+
+def compare(results: dict, baseline: dict, tolerance: float) -> list[str]:
+    regressions = []
+    for name, result in results.items():
+        base = baseline.get(name)
+        if not base:
+            continue
+
+        if result['msgs_per_sec'] < base['msgs_per_sec'] * (1 - tolerance):
+            regressions.append(f"{name}: {result['msgs_per_sec']} msgs/s "
+                               f"vs {base['msgs_per_sec']} baseline")
+        for key in ('blocks_per_msg', 'bytes_per_msg'):
+            if key in base and result[key] > base[key] * (1 + tolerance):
+                regressions.append(f"{name}: {result[key]} {key} "
+                                   f"vs {base[key]} baseline")
+    return regressions
+
+
+def main(argv: list[str] = None) -> int:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--seconds', type=float, default=0.5)
+    parser.add_argument('--repeat', type=int, default=5)
+    parser.add_argument('--tolerance', type=float, default=0.2)
+    parser.add_argument('--baseline', default=BASELINE)
+    parser.add_argument('--save', action='store_true')
+    parser.add_argument('--check', action='store_true')
+    args = parser.parse_args(argv)
+
+    results = measure(args.seconds, args.repeat)
+    baseline = {}
+    if os.path.exists(args.baseline):
+        with open(args.baseline) as f:
+            baseline = json.load(f)
+
+    print(f"{'scenario':<22} {'msgs/s':>12} {'baseline':>12} "
+          f"{'blocks/msg':>11} {'bytes/msg':>10}")
+    for name, result in results.items():
+        base = baseline.get(name, {}).get('msgs_per_sec', '-')
+        print(f"{name:<22} {result['msgs_per_sec']:>12} {base:>12} "
+              f"{result.get('blocks_per_msg', '-'):>11} "
+              f"{result.get('bytes_per_msg', '-'):>10}")
+
+    if args.save:
+        os.makedirs(os.path.dirname(args.baseline), exist_ok=True)
+        with open(args.baseline, 'w') as f:
+            json.dump(results, f, indent=2, sort_keys=True)
+            f.write('\n')
+        return 0
+
+    regressions = compare(results, baseline, args.tolerance)
+    for regression in regressions:
+        print(f"REGRESSION {regression}")
+    return 1 if args.check and regressions else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
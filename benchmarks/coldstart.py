@@ -0,0 +1,112 @@
+#!/usr/bin/env python3
+"""Measures import-to-first-response time of each handler in a fresh
+interpreter, the way a Lambda cold start sees it.
+
+Checks are pointed at the local fake server and P2P host so the numbers
+don't depend on the network:
+
+    python benchmarks/coldstart.py --runs 20
+"""
+
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+LAYER = os.path.join(ROOT, 'lib', 'python')
+HANDLERS = ['get-ip', 'server-check', 'p2p-check']
+
+# runs inside the fresh interpreter, prints timings as json
+CHILD = '''
+import json, sys, time
+start = time.perf_counter()
+import app
+imported = time.perf_counter()
+response = app.lambda_handler(json.loads(sys.argv[1]), None)
+done = time.perf_counter()
+print(json.dumps({
+    'import_ms': (imported - start) * 1000,
+    'first_response_ms': (done - start) * 1000,
+    'status': response['statusCode'],
+}))
+'''
+
+
+def responder():
+    sys.path.insert(0, LAYER)
+    from kaillera.fakeserver import (
+        FakeKailleraServer, FakeP2PPeer, ServerThread
+    )
+
+    return ServerThread(FakeKailleraServer(), FakeP2PPeer())
+
+
+def event_for(handler: str, servers) -> dict:
+    events = os.path.join(ROOT, handler, 'events')
+    with open(os.path.join(events, sorted(os.listdir(events))[0])) as f:
+        event = json.load(f)
+
+    if handler == 'server-check':
+        port = servers.servers[0].port
+        event['body'] = json.dumps({'host': '127.0.0.1', 'port': port})
+    elif handler == 'p2p-check':
+        port = servers.servers[1].port
+        event['body'] = json.dumps({'host': '127.0.0.1', 'port': port})
+    return event
+
+
+def run(handler: str, event: dict) -> dict:
+    env = dict(os.environ, PROXY_HEADER='cf-connecting-ip',
+               PYTHONDONTWRITEBYTECODE='1', PYTHONPATH=os.pathsep.join([
+                   os.path.join(ROOT, handler, 'src'), LAYER]))
+    output = subprocess.run([sys.executable, '-c', CHILD, json.dumps(event)],
+                            env=env, check=True, capture_output=True)
+    return json.loads(output.stdout)
+
+
+def summarize(values: list[float]) -> dict:
+    ordered = sorted(values)
+    return {
+        'median': round(statistics.median(ordered), 2),
+        'p95': round(ordered[max(int(len(ordered) * 0.95) - 1, 0)], 2),
+        'min': round(ordered[0], 2),
+    }
+
+
+def main(argv: list[str] = None) -> int:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('-n', '--runs', type=int, default=10)
+    parser.add_argument('--json', action='store_true')
+    parser.add_argument('handlers', nargs='*', default=HANDLERS)
+    args = parser.parse_args(argv)
+
+    results = {}
+    with responder() as servers:
+        for handler in args.handlers:
+            event = event_for(handler, servers)
+            runs = [run(handler, event) for _ in range(args.runs)]
+            results[handler] = {
+                'import_ms': summarize([r['import_ms'] for r in runs]),
+                'first_response_ms': summarize(
+                    [r['first_response_ms'] for r in runs]),
+                'status': sorted({r['status'] for r in runs}),
+            }
+
+    if args.json:
+        print(json.dumps(results, indent=2))
+        return 0
+
+    print(f"{'handler':<14} {'import (med/p95)':>20} "
+          f"{'first response (med/p95)':>28}")
+    for handler, result in results.items():
+        imp, first = result['import_ms'], result['first_response_ms']
+        print(f"{handler:<14} {imp['median']:>9.2f} / {imp['p95']:>6.2f} ms "
+              f"{first['median']:>13.2f} / {first['p95']:>8.2f} ms")
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,64 @@
+from __future__ import annotations
+import os
+import threading
+import time
+from collections import OrderedDict
+from collections.abc import Callable, Hashable
+
+
+class TTLCache:
+    def __init__(self, maxsize: int = 256, ttl: float = 30,
+                 negative_ttl: float = 5,
+                 clock: Callable[[], float] = time.monotonic):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.negative_ttl = negative_ttl
+        self.clock = clock
+
+        # least recently used first, values are (expires, value)
+        self.entries: OrderedDict[Hashable, tuple] = OrderedDict()
+        # lambda calls one handler at a time, the local gateway doesn't
+        self.lock = threading.Lock()
+
+    @classmethod
+    def from_env(cls, prefix: str = 'CACHE') -> TTLCache:
+        return cls(maxsize=int(os.environ.get(f'{prefix}_SIZE', 256)),
+                   ttl=float(os.environ.get(f'{prefix}_TTL', 30)),
+                   negative_ttl=float(
+                       os.environ.get(f'{prefix}_NEGATIVE_TTL', 5)))
+
+    def __contains__(self, key: Hashable) -> bool:
+        return self.get(key) is not None
+
+    def __len__(self):
+        return len(self.entries)
+
+    def get(self, key: Hashable, default: object = None) -> object:
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is None:
+                return default
+
+            expires, value = entry
+            if expires <= self.clock():
+                del self.entries[key]
+                return default
+
+            self.entries.move_to_end(key)
+            return value
+
+    def set(self, key: Hashable, value: object, success: bool = True):
+        ttl = self.ttl if success else self.negative_ttl
+        if ttl <= 0 or self.maxsize <= 0:
+            return
+
+        with self.lock:
+            self.entries[key] = (self.clock() + ttl, value)
+            self.entries.move_to_end(key)
+
+            while len(self.entries) > self.maxsize:
+                self.entries.popitem(last=False)
+
+    def clear(self):
+        with self.lock:
+            self.entries.clear()
@@ -0,0 +1,100 @@
+from __future__ import annotations
+import mmap
+import os
+import struct
+import time
+from collections.abc import Iterator
+
+from channels import KAILLERA, P2P, PUBLIC, RECEIVED, SENT  # noqa: F401
+
+MAGIC = b'KCAP\x01'
+
+# payload length, wall clock ns, direction, channel
+RECORD = struct.Struct('<IQBB')
+
+
+class Recorder:
+    def __init__(self, path: str, buffering: int = 1 << 16):
+        self.path = path
+        self.file = open(path, 'ab', buffering=buffering)
+        if self.file.tell() == 0:
+            self.file.write(MAGIC)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def record(self, direction: int, channel: int, data: bytes,
+               timestamp: int = None):
+        # a single write per record, so clients on several threads can
+        # share one recorder without interleaving
+        self.file.write(RECORD.pack(len(data), timestamp or time.time_ns(),
+                                    direction, channel) + data)
+
+    def flush(self):
+        self.file.flush()
+
+    def close(self):
+        if not self.file.closed:
+            self.file.close()
+
+
+class Capture:
+    def __init__(self, path: str):
+        self.path = path
+        self.file = open(path, 'rb')
+        self.map = None
+        self.view = None
+
+        # an empty file can't be mapped, it is simply a capture without
+        # records
+        if os.fstat(self.file.fileno()).st_size:
+            self.map = mmap.mmap(self.file.fileno(), 0,
+                                 access=mmap.ACCESS_READ)
+            self.view = memoryview(self.map)
+
+        if self.view is not None and self.view[:len(MAGIC)] != MAGIC:
+            self.close()
+            raise ValueError(f"{path} is not a capture")
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def __iter__(self) -> Iterator[tuple[int, int, int, memoryview]]:
+        # payloads are views into the mapping, nothing is read into memory
+        # until it is touched, copy whatever has to outlive the capture
+        view = self.view
+        if view is None:
+            return
+
+        end = len(view)
+        offset = len(MAGIC)
+        unpack = RECORD.unpack_from
+        while offset + RECORD.size <= end:
+            size, timestamp, direction, channel = unpack(view, offset)
+            offset += RECORD.size
+            if offset + size > end:
+                # a capture cut short while it was being written
+                return
+
+            yield timestamp, direction, channel, view[offset:offset + size]
+            offset += size
+
+    def close(self):
+        if self.view is not None:
+            self.view.release()
+            self.view = None
+        if self.map is not None:
+            try:
+                self.map.close()
+            except BufferError:
+                # payload views are still held somewhere, the mapping
+                # goes away with the last of them
+                pass
+            self.map = None
+        self.file.close()
@@ -0,0 +1,9 @@
+# where a captured datagram went and which socket it used, kept apart from
+# capture so clients can tag traffic without loading the capture machinery
+
+SENT = 0
+RECEIVED = 1
+
+PUBLIC = 0
+KAILLERA = 1
+P2P = 2
@@ -0,0 +1,37 @@
+from __future__ import annotations
+import socket
+import time
+
+
+class Deadline:
+    def __init__(self, seconds: float, clock=time.monotonic):
+        self.clock = clock
+        self.expires = clock() + max(seconds, 0)
+
+    @classmethod
+    def from_context(cls, context, reserve: float = 0.5,
+                     default: float = 7) -> Deadline:
+        # keep `reserve` seconds back to build and return the response
+        remaining = getattr(context, 'get_remaining_time_in_millis', None)
+        seconds = remaining() / 1000 if remaining else default
+        return cls(seconds - reserve)
+
+    def __repr__(self):
+        return f"Deadline({self.remaining():.3f}s left)"
+
+    def remaining(self) -> float:
+        return max(self.expires - self.clock(), 0)
+
+    def expired(self) -> bool:
+        return self.remaining() <= 0
+
+    def share(self, fraction: float) -> Deadline:
+        # a phase gets a fraction of whatever is left, never more
+        return Deadline(self.remaining() * min(fraction, 1), self.clock)
+
+    def timeout(self, cap: float = None) -> float:
+        remaining = self.remaining()
+        if remaining <= 0:
+            raise socket.timeout("deadline exceeded")
+
+        return min(remaining, cap) if cap is not None else remaining
@@ -0,0 +1,297 @@
+import asyncio
+import socket
+import time
+from collections.abc import Callable
+
+from deadline import Deadline
+from message import MessageBuffer
+from rto import RTOEstimator
+from stats import PingStats
+
+import kaillera.models as Kaillera
+from kaillera.client import ConnType
+from kaillera.models import (
+    KailleraMessage,
+    MessageType,
+    ServerFullException,
+    ServerNoHelloException,
+    ServerRejectException
+)
+
+
+class DatagramQueue(asyncio.DatagramProtocol):
+    def __init__(self):
+        self.queue = asyncio.Queue()
+        self.transport = None
+
+    def connection_made(self, transport: asyncio.DatagramTransport):
+        self.transport = transport
+
+    def datagram_received(self, data: bytes, addr: tuple):
+        self.queue.put_nowait(data)
+
+    def error_received(self, exc: Exception):
+        # surfaced to whoever is waiting on the next datagram
+        self.queue.put_nowait(exc)
+
+    async def recv(self, timeout: float) -> bytes:
+        try:
+            data = await asyncio.wait_for(self.queue.get(), timeout)
+        except asyncio.TimeoutError:
+            raise socket.timeout
+
+        if isinstance(data, Exception):
+            raise data
+        return data
+
+    async def recv_all(self, timeout: float, limit: int = 64) -> list[bytes]:
+        # waits for the first datagram, then takes whatever else is queued
+        datagrams = [await self.recv(timeout)]
+        while len(datagrams) < limit and not self.queue.empty():
+            data = self.queue.get_nowait()
+            # an error behind a reply is stale by now
+            if not isinstance(data, Exception):
+                datagrams.append(data)
+        return datagrams
+
+    def drain(self) -> list[bytes]:
+        # only what is already queued, errors included, never waits
+        datagrams = []
+        while not self.queue.empty():
+            data = self.queue.get_nowait()
+            if not isinstance(data, Exception):
+                datagrams.append(data)
+        return datagrams
+
+    def close(self):
+        if self.transport:
+            self.transport.close()
+
+
+async def open_endpoint(host: str, port: int) -> DatagramQueue:
+    loop = asyncio.get_running_loop()
+    _, protocol = await loop.create_datagram_endpoint(
+        DatagramQueue, remote_addr=(host, port))
+    return protocol
+
+
+class AsyncClient:
+    def __init__(self, host: str, port: int, retry: int = 3, timeout: int = 2):
+        self.host = host
+        self.server_port = port
+        self.user_port = 0
+        self.retry = retry
+        self.timeout = timeout
+
+        # `retry` retransmissions, each waiting one (backed off) RTO, all
+        # within `timeout`, so the first RTO leaves room for the others
+        self.rto = RTOEstimator(initial=timeout / (retry + 1),
+                                max_rto=timeout)
+
+        self.type_ = KailleraMessage
+        # a single send still carries 5 messages, the window only has to
+        # hold a whole batch until it is on the wire
+        self.client_buffer = MessageBuffer(manage=True, as_=self.type_,
+                                           window=32)
+        self.server_buffer = MessageBuffer(as_=self.type_, window=64)
+
+        # endpoints need a running loop, they are opened on first use
+        self.pub_sock = None
+        self.priv_sock = None
+
+    async def send_message(self, message: KailleraMessage,
+                           refresh: Callable[[], KailleraMessage] = None
+                           ) -> MessageBuffer:
+        if not self.priv_sock:
+            # Explicitly require a connect() call first
+            raise ValueError("You must connect() run first")
+
+        self.client_buffer.add(message)
+        raw = await self.__send_raw(self.priv_sock,
+                                    self.client_buffer.encode(),
+                                    resend=self.__refresher(refresh))
+
+        response = MessageBuffer.decode_all(raw, as_=self.type_)
+        [self.server_buffer.add(m) for m in reversed(response)]
+        return response
+
+    def post(self, message: KailleraMessage):
+        # fire and forget, the next datagrams repeat it within the window
+        if not self.priv_sock:
+            raise ValueError("You must connect() run first")
+
+        self.client_buffer.add(message)
+        self.priv_sock.transport.sendto(self.client_buffer.encode())
+
+    async def receive(self, timeout: float) -> list[KailleraMessage]:
+        # only messages not seen before, oldest first
+        if not self.priv_sock:
+            raise ValueError("You must connect() run first")
+
+        raw = await self.priv_sock.recv_all(timeout)
+        fresh = []
+        for message in reversed(MessageBuffer.decode_all(raw, as_=self.type_)):
+            if message.id not in self.server_buffer.messages:
+                self.server_buffer.add(message)
+                fresh.append(message)
+        return fresh
+
+    async def connect(self, username: str, client: str,
+                      conn: ConnType = None) -> MessageBuffer:
+        if not self.priv_sock:
+            await self.__hello()
+
+        join_buffer = MessageBuffer([], as_=self.type_)
+        join_types = [
+            MessageType.CLIENT_JOIN, MessageType.SERVER_REJECT,
+            MessageType.SERVER_NOTICE, MessageType.SERVER_STATUS,
+        ]
+
+        client_info = Kaillera.ClientInfo(username, client, conn.value)
+        response: MessageBuffer = await self.send_message(
+            client_info, refresh=Kaillera.ClientAck)
+
+        while type(response) == MessageBuffer:
+            message: KailleraMessage
+            for message in response:
+                if message.type_ in join_types:
+                    join_buffer.add(message)
+
+                if message.type_ == MessageType.CLIENT_JOIN:
+                    return join_buffer
+                elif message.type_ == MessageType.SERVER_REJECT:
+                    user, id, reason, _ = message.data.decode().split('\0')
+                    raise ServerRejectException(user, ord(id), reason)
+
+            response = await self.send_message(Kaillera.ClientAck(),
+                                               refresh=Kaillera.ClientAck)
+        return join_buffer
+
+    async def chat(self, message: str = '') -> MessageBuffer:
+        return await self.send_message(Kaillera.ChatGlobal(message))
+
+    async def disconnect(self, message: str = '') -> MessageBuffer:
+        return await self.send_message(Kaillera.ClientQuit(message))
+
+    async def ping(self, count: int = 3) -> tuple[int, int]:
+        stats = await self.ping_stats(count)
+        if not stats.received:
+            raise socket.timeout
+
+        return int(stats.avg), stats.lost
+
+    async def ping_stats(self, count: int = 5, interval: float = 0.05,
+                         deadline: Deadline = None) -> PingStats:
+        # probes are paced rather than sent in lock step, and since a PONG
+        # carries no sequence number replies are matched to probes in order
+        pub_sock = await self.__public()
+        sent: list[int] = []
+        rtts: list[float] = []
+
+        async def send_probes():
+            for _ in range(count):
+                sent.append(time.perf_counter_ns())
+                pub_sock.transport.sendto(b'PING\0')
+                await asyncio.sleep(interval)
+
+        sender = asyncio.ensure_future(send_probes())
+        try:
+            while len(rtts) < count:
+                timeout = self.timeout + interval
+                try:
+                    if deadline:
+                        timeout = deadline.timeout(timeout)
+                    pong = await pub_sock.recv(timeout)
+                except socket.timeout:
+                    # whatever was collected by the deadline is returned
+                    break
+
+                recv_time = time.perf_counter_ns()
+                if pong == b'PONG\0' and len(rtts) < len(sent):
+                    rtt = recv_time - sent[len(rtts)]
+                    rtts.append(rtt / 1e6)
+                    self.rto.sample(rtt / 1e9)
+        finally:
+            sender.cancel()
+
+        return PingStats(rtts + [None] * (count - len(rtts)))
+
+    def close(self):
+        for endpoint in (self.pub_sock, self.priv_sock):
+            if endpoint:
+                endpoint.close()
+        self.pub_sock = self.priv_sock = None
+
+    async def __public(self) -> DatagramQueue:
+        if not self.pub_sock:
+            self.pub_sock = await open_endpoint(self.host, self.server_port)
+        return self.pub_sock
+
+    async def __hello(self) -> int:
+        pub_sock = await self.__public()
+
+        try:
+            replies = await self.__send_raw(pub_sock, b'HELLO0.83\0')
+            # a late PONG can be queued ahead of the hello reply
+            response = next((r for r in reversed(replies)
+                             if r != b'PONG\0'), replies[-1])
+        except socket.timeout:
+            # TODO: figure out why the server does this
+            if (await self.ping(1))[1] == 0:
+                msg = "Server is refusing to respond to a hello packet"
+                raise ServerNoHelloException(msg)
+            else:
+                raise
+
+        port = response.decode().rstrip('\0').replace('HELLOD00D', '')
+        if port != 'TOO':
+            self.user_port = int(port)
+            self.priv_sock = await open_endpoint(self.host, self.user_port)
+            return port
+        else:
+            raise ServerFullException(port)
+
+    def __refresher(self, refresh: Callable[[], KailleraMessage] = None
+                    ) -> Callable[[], bytes]:
+        # servers only answer messages they haven't seen, so when the reply
+        # is what got lost only a fresh message riding along with the
+        # redundancy window gets a new one
+        if refresh is None:
+            return None
+
+        def resend() -> bytes:
+            self.client_buffer.add(refresh())
+            return self.client_buffer.encode()
+        return resend
+
+    async def __send_raw(self, client: DatagramQueue, message: bytes,
+                         retry: bool = True,
+                         resend: Callable[[], bytes] = None) -> list[bytes]:
+        # the whole exchange, retransmissions and all, gets one timeout
+        stop = time.monotonic() + self.timeout
+        # anything still queued answers an earlier exchange, it goes before
+        # the send so it can't be taken for this one's reply
+        client.drain()
+        attempts = 0
+        while True:
+            remaining = stop - time.monotonic()
+            if remaining <= 0:
+                raise socket.timeout("timed out")
+            if attempts and resend:
+                message = resend()
+            sent = time.perf_counter()
+            client.transport.sendto(message)
+
+            try:
+                recv = await client.recv_all(min(self.rto.rto, remaining))
+            except socket.timeout:
+                if not retry or attempts >= self.retry:
+                    raise
+                attempts += 1
+                self.rto.backoff()
+                continue
+
+            # Karn: a reply to a retransmission can't be timed reliably
+            if not attempts:
+                self.rto.sample(time.perf_counter() - sent)
+            return recv
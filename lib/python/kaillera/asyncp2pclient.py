@@ -0,0 +1,134 @@
+import socket
+import time
+
+from message import MessageBuffer
+from rto import RTOEstimator
+
+import kaillera.models as P2P
+from kaillera.asyncclient import DatagramQueue, open_endpoint
+from kaillera.models import (
+    P2PMessage,
+    P2PType,
+    P2PRejectException,
+)
+
+
+class AsyncP2PClient:
+    def __init__(self, host: str, port: int, retry: int = 3, timeout: int = 2):
+        self.host = host
+        self.server_port = port
+        self.user_port = 0
+        self.retry = retry
+        self.timeout = timeout
+
+        # `retry` retransmissions, each waiting one (backed off) RTO, all
+        # within `timeout`, so the first RTO leaves room for the others
+        self.rto = RTOEstimator(initial=timeout / (retry + 1),
+                                max_rto=timeout)
+
+        self.type_ = P2PMessage
+        # a single send still carries 5 messages, the window only has to
+        # hold a whole batch until it is on the wire
+        self.client_buffer = MessageBuffer(manage=True, as_=self.type_,
+                                           meta_size=2, window=32)
+        self.server_buffer = MessageBuffer(as_=self.type_, meta_size=2,
+                                           window=64)
+
+        # endpoints need a running loop, it is opened on first use
+        self.socket = None
+
+    async def send_message(self, message: P2PMessage,
+                           wait: bool = True) -> MessageBuffer:
+        if not self.socket:
+            self.socket = await open_endpoint(self.host, self.server_port)
+
+        self.client_buffer.add(message)
+        raw = await self.__send_raw(self.socket, self.client_buffer.encode(),
+                                    wait=wait)
+
+        response = MessageBuffer.decode_all(raw, as_=self.type_, meta_size=2)
+        [self.server_buffer.add(m) for m in reversed(response)]
+        return response
+
+    async def connect(self, username: str,
+                      client: str) -> tuple[bool, MessageBuffer]:
+        join_buffer = MessageBuffer([], as_=self.type_, meta_size=2)
+        join_types = [
+            P2PType.CLIENT_ACCEPT, P2PType.CLIENT_REJECT, P2PType.PLAYER_CHAT
+        ]
+
+        request = P2P.P2PClientRequest(username, client)
+        response = await self.send_message(request)
+
+        attempts = 0
+        while type(response) == MessageBuffer and attempts < 3:
+            message: P2PMessage
+            for message in response:
+                if message.type_ in join_types:
+                    join_buffer.add(message)
+
+                if message.type_ == P2PType.CLIENT_ACCEPT:
+                    await self.send_message(P2P.P2PClientAccept())
+                    return [True, join_buffer]
+                elif message.type_ == P2PType.CLIENT_REJECT:
+                    raise P2PRejectException()
+
+            attempts += 1
+            request = P2P.P2PClientRequest(username, client)
+            response = await self.send_message(request)
+
+        return [False, join_buffer]
+
+    async def chat(self, message: str = '', frame: int = 5,
+                   wait: bool = True) -> MessageBuffer:
+        return await self.send_message(P2P.P2PChat(message, frame), wait=wait)
+
+    async def disconnect(self) -> MessageBuffer:
+        # there will not be a response
+        return await self.send_message(P2P.P2PClientExit(), wait=False)
+
+    def get_host_info(self, buffer: MessageBuffer) -> tuple[str, str]:
+        message: P2PMessage
+        for message in buffer:
+            if message.type_ == P2PType.CLIENT_ACCEPT:
+                return list(filter(len, message.data.decode().split('\0')))
+
+        return [None, None]
+
+    def close(self):
+        if self.socket:
+            self.socket.close()
+        self.socket = None
+
+    async def __send_raw(self, client: DatagramQueue, message: bytes,
+                         retry: bool = True,
+                         wait: bool = True) -> list[bytes]:
+        # the whole exchange, retransmissions and all, gets one timeout
+        stop = time.monotonic() + self.timeout
+        # anything still queued answers an earlier exchange, it goes before
+        # the send so it can't be taken for this one's reply
+        client.drain()
+        attempts = 0
+        while True:
+            remaining = stop - time.monotonic()
+            if remaining <= 0:
+                raise socket.timeout("timed out")
+            sent = time.perf_counter()
+            client.transport.sendto(message)
+
+            if not wait:
+                return []
+
+            try:
+                recv = await client.recv_all(min(self.rto.rto, remaining))
+            except socket.timeout:
+                if not retry or attempts >= self.retry:
+                    raise
+                attempts += 1
+                self.rto.backoff()
+                continue
+
+            # Karn: a reply to a retransmission can't be timed reliably
+            if not attempts:
+                self.rto.sample(time.perf_counter() - sent)
+            return recv
@@ -1,9 +1,16 @@
-import copy
+import select
 import socket
 import time
+from collections.abc import Callable
 from enum import Enum
 
+from channels import KAILLERA, PUBLIC, RECEIVED, SENT
+from deadline import Deadline
 from message import MessageBuffer
+from metrics import NULL, NullMetrics, timed
+from rto import RTOEstimator
+from sockets import Receiver, SocketPool
+from stats import PingStats
 
 import kaillera.models as Kaillera
 from kaillera.models import (
@@ -25,36 +32,118 @@ class ConnType(Enum):
 
 
 class Client:
-    def __init__(self, host: str, port: int, retry: int = 1, timeout: int = 2):
+    def __init__(self, host: str, port: int, retry: int = 3, timeout: int = 2,
+                 pool: SocketPool = None, metrics: NullMetrics = NULL,
+                 recorder: 'capture.Recorder' = None):
         self.host = host
         self.server_port = port
         self.user_port = 0
         self.retry = retry
         self.timeout = timeout
+        self.pool = pool
+        self.mtu = 1400
+        self.metrics = metrics
+        self.recorder = recorder
+
+        # `retry` retransmissions, each waiting one (backed off) RTO, all
+        # within `timeout`, so the first RTO leaves room for the others
+        self.rto = RTOEstimator(initial=timeout / (retry + 1),
+                                max_rto=timeout)
+        self.receiver = Receiver()
 
         self.type_ = KailleraMessage
-        self.client_buffer = MessageBuffer(manage=True, as_=self.type_)
-        self.server_buffer = MessageBuffer(as_=self.type_)
+        # a single send still carries 5 messages, the window only has to
+        # hold a whole batch until it is on the wire
+        self.client_buffer = MessageBuffer(manage=True, as_=self.type_,
+                                           window=32, metrics=metrics)
+        self.server_buffer = MessageBuffer(as_=self.type_, window=64,
+                                           metrics=metrics)
+        # made by the first game, plain lobby checks never load the codec
+        self.inputs = None
 
         self.pub_sock = self.__socket_connect(host, self.server_port)
         self.priv_sock = None
 
-    def send_message(self, message: KailleraMessage) -> MessageBuffer:
+    def send_message(self, message: KailleraMessage,
+                     deadline: Deadline = None,
+                     refresh: Callable[[], KailleraMessage] = None
+                     ) -> MessageBuffer:
         if not self.priv_sock:
             # Explicitly require a connect() call first
             raise ValueError("You must connect() run first")
 
         self.client_buffer.add(message)
-        raw = self.__send_raw(self.priv_sock, self.client_buffer.encode())
+        raw = self.__send_raw(self.priv_sock,
+                              self.client_buffer.encode(mtu=self.mtu),
+                              deadline=deadline,
+                              resend=self.__refresher(refresh))
 
-        response = MessageBuffer(buffer=raw, as_=self.type_)
-        [self.server_buffer.add(m) for m in response]
+        response = MessageBuffer.decode_all(raw, as_=self.type_)
+        [self.server_buffer.add(m) for m in reversed(response)]
         return response
 
+    def post(self, message: KailleraMessage):
+        # fire and forget, the next datagrams repeat it within the window and
+        # whatever it triggers is drained by the next exchange
+        if not self.priv_sock:
+            raise ValueError("You must connect() run first")
+
+        self.client_buffer.add(message)
+        datagram = self.client_buffer.encode(mtu=self.mtu)
+        self.priv_sock.sendall(datagram)
+        self.metrics.incr('datagrams_sent')
+        self.metrics.incr('sent_bytes', len(datagram))
+        if self.recorder is not None:
+            self.recorder.record(SENT, KAILLERA, datagram)
+
+    def receive(self, deadline: Deadline = None) -> list[KailleraMessage]:
+        # only messages not seen before, oldest first
+        if not self.priv_sock:
+            raise ValueError("You must connect() run first")
+
+        deadline = deadline or Deadline(self.timeout)
+        self.priv_sock.settimeout(deadline.timeout(self.timeout))
+        raw = self.receiver.recv_all(self.priv_sock)
+        if self.metrics.enabled:
+            self.metrics.incr('datagrams_received', len(raw))
+            self.metrics.incr('received_bytes', sum(map(len, raw)))
+        if self.recorder is not None:
+            self.__record(RECEIVED, self.priv_sock, raw)
+
+        fresh = []
+        for message in reversed(MessageBuffer.decode_all(raw, as_=self.type_)):
+            if message.id not in self.server_buffer.messages:
+                self.server_buffer.add(message)
+                fresh.append(message)
+        return fresh
+
+    def send_messages(self, messages: list[KailleraMessage],
+                      deadline: Deadline = None) -> MessageBuffer:
+        if not self.priv_sock:
+            raise ValueError("You must connect() run first")
+
+        responses = MessageBuffer([], as_=self.type_, window=64)
+        buffer = self.client_buffer
+        for batch in buffer.pack(messages, self.mtu):
+            [buffer.add(message) for message in batch]
+            datagram = buffer.encode(max(len(batch), buffer.tx_size),
+                                     self.mtu)
+            raw = self.__send_raw(self.priv_sock, datagram,
+                                  deadline=deadline)
+
+            response = MessageBuffer.decode_all(raw, as_=self.type_)
+            for message in reversed(response):
+                self.server_buffer.add(message)
+                responses.add(message)
+        return responses
+
+    @timed('connect_ms')
     def connect(self, username: str, client: str,
-                conn: ConnType = None) -> MessageBuffer:
+                conn: ConnType = None,
+                deadline: Deadline = None) -> MessageBuffer:
         if not self.priv_sock:
-            self.__hello()
+            # the login flood needs more time than the hello round trip
+            self.__hello(deadline.share(1 / 3) if deadline else None)
 
         join_buffer = MessageBuffer([], as_=self.type_)
         join_types = [
@@ -63,58 +152,159 @@ class Client:
         ]
 
         client_info = Kaillera.ClientInfo(username, client, conn.value)
-        response: MessageBuffer = self.send_message(client_info)
+        response: MessageBuffer = self.send_message(
+            client_info, deadline, refresh=Kaillera.ClientAck)
 
         while type(response) == MessageBuffer:
             message: KailleraMessage
             for message in response:
-                if MessageType(message.type_) in join_types:
+                if message.type_ in join_types:
                     join_buffer.add(message)
 
-                if MessageType(message.type_) == MessageType.CLIENT_JOIN:
+                if message.type_ == MessageType.CLIENT_JOIN:
                     return join_buffer
-                elif MessageType(message.type_) == MessageType.SERVER_REJECT:
+                elif message.type_ == MessageType.SERVER_REJECT:
                     user, id, reason, _ = message.data.decode().split('\0')
                     raise ServerRejectException(user, ord(id), reason)
 
-            response = self.send_message(copy.deepcopy(Kaillera.ClientAck()))
+            response = self.send_message(Kaillera.ClientAck(), deadline,
+                                         refresh=Kaillera.ClientAck)
         return join_buffer
 
-    def chat(self, message: str = '') -> MessageBuffer:
-        return self.send_message(Kaillera.ChatGlobal(message))
+    def chat(self, message: str = '',
+             deadline: Deadline = None) -> MessageBuffer:
+        return self.send_message(Kaillera.ChatGlobal(message), deadline)
 
-    def disconnect(self, message: str = '') -> MessageBuffer:
-        return self.send_message(Kaillera.ClientQuit(message))
+    def chat_many(self, messages: list[str],
+                  deadline: Deadline = None) -> MessageBuffer:
+        return self.send_messages(
+            [Kaillera.ChatGlobal(message) for message in messages], deadline)
 
-    def ping(self, count: int = 3) -> tuple[int, int]:
-        rtts = []
-        while len(rtts) < count:
-            try:
-                rrt = None
-                send_time = time.time()
-                pong = self.__send_raw(self.pub_sock, b'PING\0')
-                recv_time = time.time()
+    def disconnect(self, message: str = '',
+                   deadline: Deadline = None) -> MessageBuffer:
+        return self.send_message(Kaillera.ClientQuit(message), deadline)
 
-                if pong == b'PONG\0':
-                    rrt = int((recv_time - send_time) * 1000)
-            except socket.timeout:
-                pass
+    def create_game(self, rom: str,
+                    deadline: Deadline = None) -> MessageBuffer:
+        return self.send_message(Kaillera.GameCreate(rom), deadline)
+
+    def start_game(self, deadline: Deadline = None) -> MessageBuffer:
+        self.__codec().reset()
+        return self.send_message(Kaillera.GameStart(), deadline)
 
-            rtts.append(rrt)
+    def ready(self, deadline: Deadline = None) -> MessageBuffer:
+        return self.send_message(Kaillera.GameReady(), deadline)
+
+    def send_input(self, data: bytes,
+                   deadline: Deadline = None) -> list[bytes]:
+        # sent once, the server won't answer a repeat and the inputs of a
+        # reply lost now come again with the next frame's reply
+        if not self.priv_sock:
+            raise ValueError("You must connect() run first")
+
+        self.client_buffer.add(self.__codec().encode(data))
+        try:
+            raw = self.__send_raw(self.priv_sock,
+                                  self.client_buffer.encode(mtu=self.mtu),
+                                  retry=False, deadline=deadline)
+        except socket.timeout:
+            return []
 
-        success = [i for i in rtts if i is not None]
-        if not success:
+        response = MessageBuffer.decode_all(raw, as_=self.type_)
+        [self.server_buffer.add(m) for m in reversed(response)]
+        return self.inputs.receive(response)
+
+    def ping(self, count: int = 3,
+             deadline: Deadline = None) -> tuple[int, int]:
+        stats = self.ping_stats(count, deadline=deadline)
+        if not stats.received:
             raise socket.timeout
 
-        average = int(sum(success) / len(success)) if len(success) else None
-        return average, len(rtts)-len(success)
+        return int(stats.avg), stats.lost
+
+    @timed('ping_ms')
+    def ping_stats(self, count: int = 5, interval: float = 0.05,
+                   deadline: Deadline = None) -> PingStats:
+        # probes are paced rather than sent in lock step, and since a PONG
+        # carries no sequence number replies are matched to probes in order
+        sock = self.pub_sock
+        interval_ns = int(interval * 1e9)
+        # once a round trip has been measured a late PONG is a lost one
+        timeout_ns = int((self.rto.rto if self.rto.srtt is not None
+                          else self.timeout) * 1e9)
+
+        sent: list[int] = []
+        rtts: list[float] = []
+        next_send = time.perf_counter_ns()
+
+        # whatever was collected by the deadline is returned as is
+        stop = next_send + int(deadline.remaining() * 1e9) \
+            if deadline else None
+
+        while len(rtts) < count:
+            now = time.perf_counter_ns()
+            if stop is not None and now >= stop:
+                break
+
+            if len(sent) < count and now >= next_send:
+                sock.send(b'PING\0')
+                self.metrics.incr('pings_sent')
+                if self.recorder is not None:
+                    self.recorder.record(SENT, PUBLIC, b'PING\0')
+                sent.append(now)
+                next_send = now + interval_ns
+                continue
+
+            wait_until = next_send if len(sent) < count \
+                else sent[-1] + timeout_ns
+            if stop is not None:
+                wait_until = min(wait_until, stop)
+            if now >= wait_until:
+                break
+
+            readable, _, _ = select.select([sock], [], [],
+                                           (wait_until - now) / 1e9)
+            if readable:
+                size = sock.recv_into(self.receiver.buffer)
+                pong = self.receiver.view[:size]
+                recv_time = time.perf_counter_ns()
+                if self.recorder is not None:
+                    self.recorder.record(RECEIVED, PUBLIC, pong)
+
+                if pong == b'PONG\0' and len(rtts) < len(sent):
+                    rtt = recv_time - sent[len(rtts)]
+                    rtts.append(rtt / 1e6)
+                    self.rto.sample(rtt / 1e9)
+                    self.metrics.observe('ping_rtt_ms', rtt / 1e6)
+
+        self.metrics.incr('pings_lost', count - len(rtts))
+        return PingStats(rtts + [None] * (count - len(rtts)))
+
+    def hello(self, deadline: Deadline = None) -> int:
+        return self.__hello(deadline)
+
+    def close(self):
+        for sock in (self.pub_sock, self.priv_sock):
+            if sock and self.pool is not None:
+                self.pool.release(sock)
+            elif sock:
+                sock.close()
+        self.pub_sock = self.priv_sock = None
 
-    def __hello(self) -> int:
+    @timed('hello_ms')
+    def __hello(self, deadline: Deadline = None) -> int:
         try:
-            response = self.__send_raw(self.pub_sock, b'HELLO0.83\0')
+            # a quarter is kept back for the ping that tells a server
+            # ignoring hellos apart from one that is down
+            replies = self.__send_raw(
+                self.pub_sock, b'HELLO0.83\0',
+                deadline=deadline.share(0.75) if deadline else None)
+            # a late PONG can be queued ahead of the hello reply
+            response = next((r for r in reversed(replies)
+                             if r != b'PONG\0'), replies[-1])
         except socket.timeout:
             # TODO: figure out why the server does this
-            if self.ping(1)[1] == 0:
+            if self.ping(1, deadline=deadline)[1] == 0:
                 msg = "Server is refusing to respond to a hello packet"
                 raise ServerNoHelloException(msg)
             else:
@@ -128,21 +318,88 @@ class Client:
         else:
             raise ServerFullException(port)
 
+    def __refresher(self, refresh: Callable[[], KailleraMessage] = None
+                    ) -> Callable[[], bytes]:
+        # servers only answer messages they haven't seen, so when the reply
+        # is what got lost only a fresh message riding along with the
+        # redundancy window gets a new one
+        if refresh is None:
+            return None
+
+        def resend() -> bytes:
+            self.client_buffer.add(refresh())
+            return self.client_buffer.encode(mtu=self.mtu)
+        return resend
+
+    def __codec(self) -> 'InputCodec':
+        if self.inputs is None:
+            from kaillera.game import InputCodec
+            self.inputs = InputCodec()
+        return self.inputs
+
     def __send_raw(self, client: socket.socket, message: bytes,
-                   retry: bool = False) -> bytes:
+                   retry: bool = True, deadline: Deadline = None,
+                   resend: Callable[[], bytes] = None) -> list[bytes]:
+        # without a deadline the whole exchange, retransmissions and all,
+        # still only gets the one timeout
+        deadline = deadline or Deadline(self.timeout)
+        # anything still queued answers an earlier exchange, it goes before
+        # the send so it can't be taken for this one's reply
+        stale = self.receiver.drain(client)
+        if stale:
+            self.metrics.incr('stale_datagrams', len(stale))
+            if self.recorder is not None:
+                self.__record(RECEIVED, client, stale)
+
+        # by default a retransmission is the same datagram, it still carries
+        # the whole redundancy window so any copy that gets through is enough
         attempts = 0
-        while attempts < self.retry:
+        while True:
+            if attempts and resend:
+                message = resend()
+            timeout = self.rto.rto
+            client.settimeout(deadline.timeout(timeout))
+            sent = time.perf_counter()
+            client.sendall(message)
+            self.metrics.incr('datagrams_sent')
+            self.metrics.incr('sent_bytes', len(message))
+            if self.recorder is not None:
+                self.__record(SENT, client, [message])
+
             try:
-                client.sendall(message)
-                recv, _, _, _ = client.recvmsg(4096)
-                return recv
+                recv = self.receiver.recv_all(client)
             except socket.timeout:
-                if retry and attempts < self.retry:
-                    attempts += 1
-                else:
+                self.metrics.incr('timeouts')
+                if not retry or attempts >= self.retry:
                     raise
+                attempts += 1
+                self.metrics.incr('retransmits')
+                self.rto.backoff()
+                continue
+
+            if self.metrics.enabled:
+                self.metrics.incr('datagrams_received', len(recv))
+                self.metrics.incr('received_bytes', sum(map(len, recv)))
+            if self.recorder is not None:
+                self.__record(RECEIVED, client, recv)
+
+            # Karn: a reply to a retransmission can't be timed reliably
+            if not attempts:
+                rtt = time.perf_counter() - sent
+                self.rto.sample(rtt)
+                self.metrics.observe('rtt_ms', rtt * 1000)
+            return recv
+
+    def __record(self, direction: int, client: socket.socket,
+                 datagrams: list[bytes]):
+        channel = PUBLIC if client is self.pub_sock else KAILLERA
+        for datagram in datagrams:
+            self.recorder.record(direction, channel, datagram)
 
     def __socket_connect(self, host: str, port: int):
+        if self.pool is not None:
+            return self.pool.acquire(host, port, self.timeout)
+
         attempts = 0
 
         while attempts < self.retry:
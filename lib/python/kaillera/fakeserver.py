@@ -0,0 +1,430 @@
+#!/usr/bin/env python3
+
+import argparse
+import asyncio
+import random
+import struct
+import threading
+
+from message import MessageBuffer
+
+from kaillera.game import InputCodec
+from kaillera.models import (
+    KailleraMessage,
+    MessageType,
+    P2PMessage,
+    P2PType,
+)
+import primitives as types
+
+
+class Conditions:
+    def __init__(self, latency: float = 0, jitter: float = 0,
+                 loss: float = 0, reorder: float = 0,
+                 reorder_delay: float = 0.05, seed: int = None):
+        # latency is one way, in seconds, and applied to replies only, all of
+        # it drawn from a seeded rng so a run can be reproduced
+        self.latency = latency
+        self.jitter = jitter
+        self.loss = loss
+        self.reorder = reorder
+        self.reorder_delay = reorder_delay
+        self.random = random.Random(seed)
+
+    def dropped(self) -> bool:
+        return self.loss > 0 and self.random.random() < self.loss
+
+    def delay(self) -> float:
+        delay = self.latency
+        if self.jitter:
+            delay += self.random.uniform(-self.jitter, self.jitter)
+        if self.reorder and self.random.random() < self.reorder:
+            # held back long enough for later datagrams to overtake it
+            delay += self.reorder_delay
+        return max(delay, 0)
+
+
+class Endpoint(asyncio.DatagramProtocol):
+    def __init__(self, conditions: Conditions):
+        self.conditions = conditions
+        self.transport: asyncio.DatagramTransport = None
+        self.received = 0
+        self.sent = 0
+
+    @property
+    def port(self) -> int:
+        return self.transport.get_extra_info('sockname')[1]
+
+    def connection_made(self, transport: asyncio.DatagramTransport):
+        self.transport = transport
+
+    def datagram_received(self, data: bytes, addr: tuple):
+        if self.conditions.dropped():
+            return
+
+        self.received += 1
+        self.handle(data, addr)
+
+    def handle(self, data: bytes, addr: tuple):
+        raise NotImplementedError
+
+    def send(self, data: bytes, addr: tuple):
+        if self.conditions.dropped():
+            return
+
+        self.sent += 1
+        delay = self.conditions.delay()
+        if delay:
+            loop = asyncio.get_running_loop()
+            loop.call_later(delay, self.__sendto, data, addr)
+        else:
+            self.__sendto(data, addr)
+
+    def close(self):
+        if self.transport:
+            self.transport.close()
+
+    def __sendto(self, data: bytes, addr: tuple):
+        if not self.transport.is_closing():
+            self.transport.sendto(data, addr)
+
+
+class FakeUser(Endpoint):
+    def __init__(self, server: 'FakeKailleraServer', user_id: int):
+        super().__init__(server.conditions)
+        self.server = server
+        self.user_id = user_id
+        self.username = ''
+        self.emulator = ''
+        self.conn_type = 1
+        self.addr = None
+
+        self.acks = 0
+        self.joined = False
+        self.chats: list[str] = []
+
+        self.client_buffer = MessageBuffer(manage=True, as_=KailleraMessage,
+                                           window=5)
+        self.seen = MessageBuffer(as_=KailleraMessage, window=64)
+        self.inputs = InputCodec()
+
+    def handle(self, data: bytes, addr: tuple):
+        self.addr = addr
+        response = MessageBuffer(buffer=data, as_=KailleraMessage)
+
+        queued = False
+        for message in reversed(response):
+            if message.id in self.seen.messages:
+                continue
+
+            self.seen.add(message)
+            queued |= self.dispatch(message)
+
+        if queued:
+            self.flush()
+
+    def dispatch(self, message: KailleraMessage) -> bool:
+        if message.type_ == MessageType.CLIENT_INFO:
+            username, emulator, conn = message.data.split(b'\0', 2)
+            self.username = username.decode()
+            self.emulator = emulator.decode()
+            self.conn_type = conn[0] if conn else 1
+            return self.queue(MessageType.SERVER_ACK, ack_data())
+        elif message.type_ == MessageType.CLIENT_ACK:
+            return self.acked()
+        elif message.type_ == MessageType.CHAT_GLOBAL:
+            text = message.data.split(b'\0')[1].decode()
+            self.chats.append(text)
+            self.server.broadcast(MessageType.CHAT_GLOBAL, b''.join([
+                types.stringz(self.username), types.stringz(text),
+            ]))
+        elif message.type_ == MessageType.CLIENT_QUIT:
+            text = message.data[3:].rstrip(b'\0').decode()
+            self.server.quit(self, text)
+        elif message.type_ == MessageType.GAME_CREATE:
+            rom = message.data[1:].split(b'\0', 1)[0].decode()
+            self.server.games.append({'rom': rom, 'owner': self.username,
+                                      'emulator': self.emulator})
+            self.server.broadcast(MessageType.GAME_CREATE, b''.join([
+                types.stringz(self.username), types.stringz(rom),
+                types.stringz(self.emulator),
+                types.uint(len(self.server.games), 4),
+            ]))
+        elif message.type_ == MessageType.GAME_START:
+            # every game is played alone: frame delay 1, player 1 of 1
+            self.inputs.reset()
+            return self.queue(MessageType.GAME_START, b''.join([
+                b'\0', types.uint(1, 2), types.uint(1, 1), types.uint(1, 1),
+            ]))
+        elif message.type_ == MessageType.GAME_READY:
+            return self.queue(MessageType.GAME_READY, b'\0')
+        elif message.type_ in (MessageType.GAME_DATA, MessageType.GAME_CACHE):
+            # with no other players the frame's input is the user's own
+            data = self.inputs.decode(message)
+            self.client_buffer.add(self.inputs.encode(data))
+            return True
+        return False
+
+    def acked(self) -> bool:
+        self.acks += 1
+        if self.joined:
+            return False
+
+        if self.acks < self.server.ack_rounds:
+            return self.queue(MessageType.SERVER_ACK, ack_data())
+
+        self.joined = True
+        self.queue(MessageType.SERVER_STATUS, self.server.status(self))
+        self.server.broadcast(MessageType.CLIENT_JOIN, b''.join([
+            types.stringz(self.username),
+            types.uint(self.user_id, 2),
+            types.uint(self.server.user_ping, 4),
+            types.uint(self.conn_type, 1),
+        ]))
+        self.queue(MessageType.SERVER_NOTICE, b''.join([
+            types.stringz('Server'), types.stringz(self.server.motd),
+        ]))
+        return True
+
+    def queue(self, type_: MessageType, data: bytes) -> bool:
+        self.client_buffer.add(KailleraMessage(type_=type_, data=data))
+        return True
+
+    def flush(self):
+        if self.addr:
+            self.send(self.client_buffer.encode(), self.addr)
+
+
+class PublicEndpoint(Endpoint):
+    def __init__(self, server: 'FakeKailleraServer'):
+        super().__init__(server.conditions)
+        self.server = server
+
+    def handle(self, data: bytes, addr: tuple):
+        if data == b'PING\0':
+            self.send(b'PONG\0', addr)
+        elif data.startswith(b'HELLO'):
+            loop = asyncio.get_running_loop()
+            loop.create_task(self.hello(addr))
+
+    async def hello(self, addr: tuple):
+        user = await self.server.allocate()
+        if user is None:
+            self.send(b'TOO\0', addr)
+        else:
+            self.send(f'HELLOD00D{user.port}\0'.encode(), addr)
+
+
+class FakeKailleraServer:
+    def __init__(self, conditions: Conditions = None, max_users: int = 100,
+                 ack_rounds: int = 4, motd: str = 'Welcome to the fake server',
+                 games: list[dict] = None, user_ping: int = 0):
+        self.conditions = conditions or Conditions()
+        self.max_users = max_users
+        self.ack_rounds = ack_rounds
+        self.motd = motd
+        self.games = games or []
+        self.user_ping = user_ping
+
+        self.host = '127.0.0.1'
+        self.public: PublicEndpoint = None
+        self.users: dict[int, FakeUser] = {}
+        self.next_user_id = 1
+
+    @property
+    def port(self) -> int:
+        return self.public.port
+
+    async def start(self, host: str = '127.0.0.1', port: int = 0):
+        loop = asyncio.get_running_loop()
+        self.host = host
+        _, self.public = await loop.create_datagram_endpoint(
+            lambda: PublicEndpoint(self), local_addr=(host, port))
+        return self
+
+    async def allocate(self) -> FakeUser:
+        if len(self.users) >= self.max_users:
+            return None
+
+        loop = asyncio.get_running_loop()
+        user_id = self.next_user_id
+        self.next_user_id = (self.next_user_id % 0xffff) + 1
+
+        _, user = await loop.create_datagram_endpoint(
+            lambda: FakeUser(self, user_id), local_addr=(self.host, 0))
+        self.users[user_id] = user
+        return user
+
+    def broadcast(self, type_: MessageType, data: bytes):
+        for user in list(self.users.values()):
+            if user.joined:
+                user.queue(type_, data)
+                user.flush()
+
+    def quit(self, user: FakeUser, message: str):
+        self.broadcast(MessageType.CLIENT_QUIT, b''.join([
+            types.stringz(user.username),
+            types.uint(user.user_id, 2),
+            types.stringz(message),
+        ]))
+        self.users.pop(user.user_id, None)
+
+        # let the goodbye leave before the user's port goes away
+        loop = asyncio.get_running_loop()
+        loop.call_later(max(self.conditions.latency, 0) + 0.5, user.close)
+
+    def status(self, joining: FakeUser) -> bytes:
+        users = [u for u in self.users.values()
+                 if u.joined and u is not joining]
+        data = [b'\0', types.uint(len(users), 4),
+                types.uint(len(self.games), 4)]
+
+        for user in users:
+            data += [
+                types.stringz(user.username),
+                types.uint(self.user_ping, 4),
+                types.uint(1, 1),
+                types.uint(user.user_id, 2),
+                types.uint(user.conn_type, 1),
+            ]
+        for id, game in enumerate(self.games, 1):
+            data += [
+                types.stringz(game.get('rom', 'Smash Remix')),
+                types.uint(game.get('id', id), 4),
+                types.stringz(game.get('emulator', 'Project64k')),
+                types.stringz(game.get('owner', 'fake')),
+                types.stringz(game.get('players', '1/2')),
+                types.uint(game.get('status', 0), 1),
+            ]
+        return b''.join(data)
+
+    def close(self):
+        for user in self.users.values():
+            user.close()
+        self.users.clear()
+        if self.public:
+            self.public.close()
+
+
+class FakeP2PPeer(Endpoint):
+    def __init__(self, conditions: Conditions = None,
+                 username: str = 'fake-host', game: str = 'Smash Remix'):
+        super().__init__(conditions or Conditions())
+        self.username = username
+        self.game = game
+        self.peers: dict[tuple, tuple[MessageBuffer, MessageBuffer]] = {}
+        self.chats: list[str] = []
+        self.exited: list[tuple] = []
+
+    async def start(self, host: str = '127.0.0.1', port: int = 0):
+        loop = asyncio.get_running_loop()
+        await loop.create_datagram_endpoint(lambda: self,
+                                            local_addr=(host, port))
+        return self
+
+    def handle(self, data: bytes, addr: tuple):
+        if addr not in self.peers:
+            self.peers[addr] = (
+                MessageBuffer(manage=True, as_=P2PMessage, meta_size=2,
+                              window=5),
+                MessageBuffer(as_=P2PMessage, meta_size=2, window=64),
+            )
+        outgoing, seen = self.peers[addr]
+
+        response = MessageBuffer(buffer=data, as_=P2PMessage, meta_size=2)
+        for message in reversed(response):
+            if message.id in seen.messages:
+                continue
+
+            seen.add(message)
+            self.dispatch(message, outgoing)
+
+        if addr in self.peers and len(outgoing):
+            # the window is resent on every datagram so a lost reply is
+            # recovered by whatever the client sends next
+            self.send(outgoing.encode(), addr)
+
+    def dispatch(self, message: P2PMessage, outgoing: MessageBuffer):
+        if message.type_ == P2PType.CLIENT_REQUEST:
+            data = types.stringz(self.username) + types.stringz(self.game)
+            outgoing.add(P2PMessage(type_=P2PType.CLIENT_ACCEPT, data=data))
+        elif message.type_ == P2PType.PLAYER_CHAT:
+            self.chats.append(message.data[4:].rstrip(b'\0').decode())
+        elif message.type_ == P2PType.PING_PING:
+            outgoing.add(P2PMessage(type_=P2PType.PING_ECHO,
+                                    data=message.data))
+        elif message.type_ == P2PType.CLIENT_EXIT:
+            self.exited.append(message)
+
+
+def ack_data() -> bytes:
+    return b'\0' + struct.pack('<IIII', 0, 1, 2, 3)
+
+
+class ServerThread:
+    # runs the fakes on a private event loop, so blocking clients can talk
+    # to them from the calling thread
+    def __init__(self, *servers):
+        self.servers = servers
+        self.loop = asyncio.new_event_loop()
+        self.thread = threading.Thread(target=self.loop.run_forever,
+                                       daemon=True)
+
+    def __enter__(self):
+        self.thread.start()
+        for server in self.servers:
+            self.call(server.start())
+        return self
+
+    def __exit__(self, *exc):
+        self.stop()
+
+    def call(self, coro):
+        return asyncio.run_coroutine_threadsafe(coro, self.loop).result()
+
+    def stop(self):
+        if not self.loop.is_running():
+            return
+
+        async def shutdown():
+            for server in self.servers:
+                server.close()
+
+        self.call(shutdown())
+        self.loop.call_soon_threadsafe(self.loop.stop)
+        self.thread.join()
+        self.loop.close()
+
+
+async def serve(args: argparse.Namespace):
+    conditions = Conditions(latency=args.latency, jitter=args.jitter,
+                            loss=args.loss, reorder=args.reorder,
+                            seed=args.seed)
+    server = await FakeKailleraServer(conditions).start(args.host, args.port)
+    peer = await FakeP2PPeer(conditions).start(args.host, args.p2p_port)
+    print(f"kaillera on {args.host}:{server.port}, "
+          f"p2p on {args.host}:{peer.port}", flush=True)
+    await asyncio.Event().wait()
+
+
+def main(argv: list[str] = None):
+    parser = argparse.ArgumentParser(
+        description="Serve a fake kaillera server and P2P host offline")
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=27888)
+    parser.add_argument('--p2p-port', type=int, default=27886)
+    parser.add_argument('--latency', type=float, default=0)
+    parser.add_argument('--jitter', type=float, default=0)
+    parser.add_argument('--loss', type=float, default=0)
+    parser.add_argument('--reorder', type=float, default=0)
+    parser.add_argument('--seed', type=int, default=None)
+    args = parser.parse_args(argv)
+
+    try:
+        asyncio.run(serve(args))
+    except KeyboardInterrupt:
+        pass
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,119 @@
+from __future__ import annotations
+
+from message import MessageBuffer
+from primitives import Reader
+
+import kaillera.models as Kaillera
+from kaillera.models import KailleraMessage, MessageType
+
+CACHE_SIZE = 256
+
+
+class InputCache:
+    # both ends keep one of these per direction and add every GAME_DATA
+    # payload to it in order, so a slot means the same input on either side
+    __slots__ = ('entries', 'index', 'next', 'hits', 'misses')
+
+    def __init__(self, size: int = CACHE_SIZE):
+        # a ring, so eviction doesn't move anything, slots are counted from
+        # the oldest entry the way the protocol's shifting FIFO counts them
+        self.entries: list[bytes | None] = [None] * size
+        # payload -> position in the ring, so finding a repeat doesn't scan
+        self.index: dict[bytes, int] = {}
+        self.next = 0
+        self.hits = 0
+        self.misses = 0
+
+    def __len__(self):
+        return len(self.index)
+
+    def __contains__(self, data: bytes):
+        return data in self.index
+
+    def find(self, data: bytes) -> int | None:
+        position = self.index.get(data)
+        if position is None:
+            self.misses += 1
+            return None
+
+        self.hits += 1
+        return (position - self.oldest()) % len(self.entries)
+
+    def add(self, data: bytes) -> int:
+        # a full cache drops its oldest entry and every slot moves down one
+        position = self.next
+        evicted = self.entries[position]
+        if evicted is not None and self.index.get(evicted) == position:
+            del self.index[evicted]
+
+        self.entries[position] = data
+        self.index[data] = position
+        self.next = (position + 1) % len(self.entries)
+        return (position - self.oldest()) % len(self.entries)
+
+    def get(self, slot: int) -> bytes:
+        data = None
+        if 0 <= slot < len(self.entries):
+            position = (self.oldest() + slot) % len(self.entries)
+            data = self.entries[position]
+        if data is None:
+            raise ValueError(f"cache slot {slot} is empty")
+        return data
+
+    def oldest(self) -> int:
+        # entries fill in order, the next one to be written is only taken
+        # once the cache is full
+        return self.next if self.entries[self.next] is not None else 0
+
+    def clear(self):
+        self.entries = [None] * len(self.entries)
+        self.index.clear()
+        self.next = 0
+
+
+class InputCodec:
+    def __init__(self, size: int = CACHE_SIZE):
+        self.outgoing = InputCache(size)
+        self.incoming = InputCache(size)
+        self.seen = MessageBuffer(as_=KailleraMessage, window=64)
+
+    def encode(self, data: bytes) -> KailleraMessage:
+        slot = self.outgoing.find(data)
+        if slot is not None:
+            return Kaillera.GameCache(slot)
+
+        self.outgoing.add(data)
+        return Kaillera.GameData(data)
+
+    def decode(self, message: KailleraMessage) -> bytes:
+        reader = Reader(message.data, 1)
+        if message.type_ == MessageType.GAME_CACHE:
+            return self.incoming.get(reader.uint(1))
+
+        size = reader.uint(2)
+        data = bytes(message.data[3:3 + size])
+        if len(data) != size:
+            raise ValueError(f"game data is {len(data)} bytes, not {size}")
+        self.incoming.add(data)
+        return data
+
+    def receive(self, messages: MessageBuffer) -> list[bytes]:
+        # messages come newest first and repeat across datagrams, every
+        # input is decoded exactly once and in order or the caches drift
+        inputs = []
+        for message in reversed(messages):
+            if message.type_ not in (MessageType.GAME_DATA,
+                                     MessageType.GAME_CACHE):
+                continue
+            if message.id in self.seen.messages:
+                continue
+
+            self.seen.add(message)
+            inputs.append(self.decode(message))
+        return inputs
+
+    def reset(self):
+        # caches only live as long as one game
+        self.outgoing.clear()
+        self.incoming.clear()
+        self.seen = MessageBuffer(as_=KailleraMessage, window=64)
@@ -0,0 +1,227 @@
+#!/usr/bin/env python3
+
+import argparse
+import json
+import os
+import sys
+import time
+from collections import Counter
+from contextlib import ExitStack
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+
+from deadline import Deadline
+from stats import Histogram
+
+import kaillera.client as Kaillera
+import kaillera.models as Models
+from kaillera.client import ConnType
+from kaillera.models import MessageType
+from kaillera.scanner import parse_target
+
+PHASES = ['hello', 'login', 'chat', 'quit']
+
+
+class Schedule:
+    def __init__(self, users: int = 100, ramp: float = 10, chats: int = 3,
+                 chat_interval: float = 1, stay: float = 5,
+                 keepalive: float = 2, timeout: float = 2, retry: int = 3):
+        self.users = users
+        self.ramp = ramp
+        self.chats = chats
+        self.chat_interval = chat_interval
+        self.stay = stay
+        self.keepalive = keepalive
+        self.timeout = timeout
+        self.retry = retry
+
+    def start_of(self, user: int) -> float:
+        # arrivals are spread evenly over the ramp
+        return self.ramp * user / max(self.users, 1)
+
+
+def rate(failed: int, succeeded: int) -> float:
+    attempts = succeeded + failed
+    return round(failed / attempts, 4) if attempts else 0
+
+
+class Result:
+    def __init__(self):
+        self.phases = {phase: Histogram() for phase in PHASES}
+        self.failures: Counter = Counter()
+        self.users = 0
+        self.completed = 0
+        # keepalives get no reply, so there is no latency to record
+        self.keepalives = 0
+
+    def merge(self, other: 'Result') -> 'Result':
+        for phase, histogram in other.phases.items():
+            self.phases[phase].merge(histogram)
+        self.failures.update(other.failures)
+        self.users += other.users
+        self.completed += other.completed
+        self.keepalives += other.keepalives
+        return self
+
+    def failed(self, phase: str) -> int:
+        return sum(count for (name, _), count in self.failures.items()
+                   if name == phase)
+
+    def as_dict(self) -> dict:
+        phases = {}
+        for phase, histogram in self.phases.items():
+            failed = self.failed(phase)
+            phases[phase] = dict(histogram.as_dict(), failed=failed,
+                                 failure_rate=rate(failed, histogram.count))
+
+        failed = self.failed('keepalive')
+        return {
+            'users': self.users,
+            'completed': self.completed,
+            'keepalives': {'sent': self.keepalives, 'failed': failed,
+                           'failure_rate': rate(failed, self.keepalives)},
+            'phases': phases,
+            'failures': {f'{phase}:{error}': count for (phase, error), count
+                         in self.failures.most_common()},
+        }
+
+
+def simulate(host: str, port: int, user: int, schedule: Schedule,
+             epoch: float) -> Result:
+    # one user: hello, login flood, chats with keepalives between, quit
+    result = Result()
+    result.users = 1
+    phase = 'hello'
+    client = None
+
+    delay = epoch + schedule.start_of(user) - time.time()
+    if delay > 0:
+        time.sleep(delay)
+
+    def timed(name, call, *args):
+        nonlocal phase
+        phase = name
+        start = time.perf_counter()
+        value = call(*args)
+        result.phases[name].record((time.perf_counter() - start) * 1000)
+        return value
+
+    def exchange(name, message, type_, reply):
+        # the clock stops on the server's answer to this user's own message,
+        # not on a broadcast some other user caused that got here first
+        nonlocal phase
+        phase = name
+        deadline = Deadline(schedule.timeout)
+        start = time.perf_counter()
+        messages = client.send_message(message, deadline)
+        while not any(m.type_ == type_ and m.data.startswith(reply)
+                      for m in messages):
+            messages = client.receive(deadline)
+        result.phases[name].record((time.perf_counter() - start) * 1000)
+
+    try:
+        client = Kaillera.Client(host, port, retry=schedule.retry,
+                                 timeout=schedule.timeout)
+        timed('hello', client.hello)
+        name = f'load{user}'
+        timed('login', client.connect, name, 'loadgen', ConnType.LAN)
+
+        leave = time.monotonic() + schedule.stay
+        chats = 0
+        while chats < schedule.chats or time.monotonic() < leave:
+            if chats < schedule.chats:
+                text = f'{name} message {chats}'
+                exchange('chat', Models.ChatGlobal(text),
+                         MessageType.CHAT_GLOBAL,
+                         f'{name}\0{text}\0'.encode())
+                chats += 1
+                pause = schedule.chat_interval
+            else:
+                phase = 'keepalive'
+                client.post(Models.KeepAlive())
+                result.keepalives += 1
+                pause = schedule.keepalive
+            time.sleep(max(min(pause, leave - time.monotonic()), 0))
+
+        # the server answers a quit, so a lost one shows up as a failure
+        exchange('quit', Models.ClientQuit('load test done'),
+                 MessageType.CLIENT_QUIT, f'{name}\0'.encode())
+        result.completed = 1
+    except Exception as e:
+        result.failures[phase, type(e).__name__] += 1
+    finally:
+        if client:
+            client.close()
+    return result
+
+
+def worker(host: str, port: int, users: list[int], schedule: Schedule,
+           epoch: float, threads: int) -> Result:
+    # runs in its own process, each simulated user blocks on its own thread
+    total = Result()
+    with ThreadPoolExecutor(max_workers=threads) as pool:
+        futures = [pool.submit(simulate, host, port, user, schedule, epoch)
+                   for user in users]
+        for future in futures:
+            total.merge(future.result())
+    return total
+
+
+def run(host: str, port: int, schedule: Schedule, processes: int = None,
+        threads: int = 256) -> Result:
+    processes = processes or os.cpu_count() or 1
+    shards = [list(range(schedule.users))[i::processes]
+              for i in range(processes)]
+
+    # every process starts its users off the same clock
+    epoch = time.time() + 0.5
+    total = Result()
+    with ProcessPoolExecutor(max_workers=processes) as pool:
+        futures = [pool.submit(worker, host, port, shard, schedule, epoch,
+                               min(threads, len(shard)))
+                   for shard in shards if shard]
+        for future in futures:
+            total.merge(future.result())
+    return total
+
+
+def main(argv: list[str] = None) -> int:
+    parser = argparse.ArgumentParser(
+        description="Simulate many kaillera users against one server")
+    parser.add_argument('server', nargs='?', default=None,
+                        help="host:port, leave out to use a local fake")
+    parser.add_argument('-u', '--users', type=int, default=100)
+    parser.add_argument('-p', '--processes', type=int, default=None)
+    parser.add_argument('-t', '--threads', type=int, default=256,
+                        help="concurrent users per process")
+    parser.add_argument('--ramp', type=float, default=10)
+    parser.add_argument('--chats', type=int, default=3)
+    parser.add_argument('--chat-interval', type=float, default=1)
+    parser.add_argument('--stay', type=float, default=5)
+    parser.add_argument('--keepalive', type=float, default=2)
+    parser.add_argument('--timeout', type=float, default=2)
+    args = parser.parse_args(argv)
+
+    schedule = Schedule(args.users, args.ramp, args.chats,
+                        args.chat_interval, args.stay, args.keepalive,
+                        args.timeout)
+
+    with ExitStack() as stack:
+        if args.server:
+            host, port = parse_target(args.server)
+        else:
+            from kaillera.fakeserver import FakeKailleraServer, ServerThread
+
+            fake = stack.enter_context(
+                ServerThread(FakeKailleraServer(max_users=args.users)))
+            host, port = '127.0.0.1', fake.servers[0].port
+
+        start = time.time()
+        result = run(host, port, schedule, args.processes, args.threads)
+
+    print(json.dumps(dict(result.as_dict(), host=host, port=port,
+                          elapsed=round(time.time() - start, 3)), indent=2))
+    return 0 if result.completed == result.users else 1
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,212 @@
+from __future__ import annotations
+from collections.abc import Callable
+from enum import Enum
+
+from primitives import Reader
+
+from kaillera.models import KailleraMessage, MessageType
+
+
+class UserStatus(Enum):
+    PLAYING = 0
+    IDLE = 1
+    UNKNOWN = 100
+
+
+class GameStatus(Enum):
+    WAITING = 0
+    PLAYING = 1
+    NETSYNC = 2
+    UNKNOWN = 100
+
+
+USER_STATUSES = {s.value: s for s in UserStatus}
+GAME_STATUSES = {s.value: s for s in GameStatus}
+
+
+class User:
+    __slots__ = ('id', 'username', 'ping', 'status', 'conn')
+
+    def __init__(self, id: int, username: str, ping: int = 0,
+                 status: UserStatus = UserStatus.IDLE, conn: int = 0):
+        self.id = id
+        self.username = username
+        self.ping = ping
+        self.status = status
+        self.conn = conn
+
+    def __repr__(self):
+        return f"User({self.id}, {self.username!r}, {self.ping}ms)"
+
+
+class Game:
+    __slots__ = ('id', 'rom', 'emulator', 'owner', 'players', 'max_players',
+                 'status')
+
+    def __init__(self, id: int, rom: str, emulator: str = '',
+                 owner: str = '', players: int = 1, max_players: int = 0,
+                 status: GameStatus = GameStatus.WAITING):
+        self.id = id
+        self.rom = rom
+        self.emulator = emulator
+        self.owner = owner
+        self.players = players
+        self.max_players = max_players
+        self.status = status
+
+    def __repr__(self):
+        return (f"Game({self.id}, {self.rom!r}, {self.players}/"
+                f"{self.max_players or '?'}, {self.status.name})")
+
+    @property
+    def open(self) -> bool:
+        # the player limit is only known once a GAME_STATUS came by
+        return self.status == GameStatus.WAITING and \
+            (not self.max_players or self.players < self.max_players)
+
+
+def parse_players(value: str) -> tuple[int, int]:
+    # status lists players as 'current/max'
+    players, _, max_players = value.partition('/')
+    try:
+        return int(players), int(max_players or 0)
+    except ValueError:
+        return 0, 0
+
+
+class LobbyState:
+    def __init__(self):
+        self.users: dict[int, User] = {}
+        self.games: dict[int, Game] = {}
+
+        # rom -> game id -> game, kept in step with `games`
+        self.roms: dict[str, dict[int, Game]] = {}
+
+        self.handlers: dict[MessageType, Callable[[Reader], None]] = {
+            MessageType.SERVER_STATUS: self.snapshot,
+            MessageType.CLIENT_JOIN: self.user_join,
+            MessageType.CLIENT_QUIT: self.user_quit,
+            MessageType.GAME_CREATE: self.game_create,
+            MessageType.GAME_STATUS: self.game_status,
+            MessageType.GAME_CLOSE: self.game_close,
+        }
+
+    def __repr__(self):
+        return f"LobbyState(users={len(self.users)}, games={len(self.games)})"
+
+    def apply(self, message: KailleraMessage) -> bool:
+        handler = self.handlers.get(message.type_)
+        if handler is None:
+            return False
+
+        try:
+            handler(Reader(message.data))
+        except (ValueError, IndexError):
+            # a malformed payload leaves the state as it was
+            return False
+        return True
+
+    def attach(self, session) -> LobbyState:
+        for type_ in self.handlers:
+            session.on(type_, lambda _, message: self.apply(message))
+        return self
+
+    def snapshot(self, reader: Reader):
+        reader.string()
+        user_count = reader.uint(4)
+        game_count = reader.uint(4)
+
+        users = {}
+        for _ in range(user_count):
+            username = reader.string()
+            ping = reader.uint(4)
+            status = USER_STATUSES.get(reader.uint(1), UserStatus.UNKNOWN)
+            id = reader.uint(2)
+            users[id] = User(id, username, ping, status, reader.uint(1))
+
+        games = []
+        for _ in range(game_count):
+            rom = reader.string()
+            id = reader.uint(4)
+            emulator = reader.string()
+            owner = reader.string()
+            players, max_players = parse_players(reader.string())
+            status = GAME_STATUSES.get(reader.uint(1), GameStatus.UNKNOWN)
+            games.append(Game(id, rom, emulator, owner, players, max_players,
+                              status))
+
+        # a snapshot replaces everything, the joining user itself is not in
+        # it and arrives with its own CLIENT_JOIN right after
+        self.users = users
+        self.games.clear()
+        self.roms.clear()
+        for game in games:
+            self.add_game(game)
+
+    def user_join(self, reader: Reader):
+        username = reader.string()
+        id = reader.uint(2)
+        ping = reader.uint(4)
+        self.users[id] = User(id, username, ping, UserStatus.IDLE,
+                              reader.uint(1))
+
+    def user_quit(self, reader: Reader):
+        reader.string()
+        self.users.pop(reader.uint(2), None)
+
+    def game_create(self, reader: Reader):
+        owner = reader.string()
+        rom = reader.string()
+        emulator = reader.string()
+        id = reader.uint(4)
+        self.add_game(Game(id, rom, emulator, owner))
+
+    def game_status(self, reader: Reader):
+        reader.string()
+        game = self.games.get(reader.uint(4))
+        status = GAME_STATUSES.get(reader.uint(1), GameStatus.UNKNOWN)
+        players = reader.uint(1)
+        max_players = reader.uint(1)
+
+        # a game created before we joined and missed by the snapshot
+        if game is None:
+            return
+        game.status = status
+        game.players = players
+        game.max_players = max_players
+
+    def game_close(self, reader: Reader):
+        reader.string()
+        game = self.games.pop(reader.uint(4), None)
+        if game is None:
+            return
+
+        by_rom = self.roms.get(game.rom)
+        if by_rom is not None:
+            by_rom.pop(game.id, None)
+            if not by_rom:
+                del self.roms[game.rom]
+
+    def add_game(self, game: Game):
+        previous = self.games.get(game.id)
+        if previous is not None and previous.rom != game.rom:
+            self.roms.get(previous.rom, {}).pop(game.id, None)
+
+        self.games[game.id] = game
+        self.roms.setdefault(game.rom, {})[game.id] = game
+
+    def players_online(self) -> int:
+        return len(self.users)
+
+    def open_games(self, rom: str = None) -> list[Game]:
+        games = self.games if rom is None else self.roms.get(rom, {})
+        return [game for game in games.values() if game.open]
+
+    def summary(self) -> dict:
+        return {
+            'users': len(self.users),
+            'games': len(self.games),
+            'open_games': len(self.open_games()),
+            'playing': sum(1 for u in self.users.values()
+                           if u.status == UserStatus.PLAYING),
+        }
@@ -1,3 +1,4 @@
+import struct
 from enum import Enum
 
 from message import Message
@@ -31,7 +32,13 @@ class MessageType(Enum):
     UNKNOWN = 100
 
 
+MESSAGE_HEADER = struct.Struct('<HHB')
+MESSAGE_TYPES = {t.value: t for t in MessageType}
+
+
 class KailleraMessage(Message):
+    __slots__ = ()
+
     def __init__(self, id: int = None, size: int = 0,
                  type_: MessageType = MessageType.UNKNOWN,
                  data: bytes = b''):
@@ -41,23 +48,21 @@ class KailleraMessage(Message):
         return f"{MessageType(self.type_)} (len = {self.size}): {self.data}"
 
     @classmethod
-    def decode(self, stream: bytes) -> Message:
-        id = int.from_bytes(stream[0:1], types.ORDER)
-        size = int.from_bytes(stream[2:3], types.ORDER)
-        type_ = MessageType(int.from_bytes(stream[4:5], types.ORDER))
-        data = stream[5:(4+size)]   # type is included in size
-        return KailleraMessage(id=id, size=size, type_=type_, data=data)
+    def decode(self, stream: bytes, offset: int = 0) -> Message:
+        view = stream if type(stream) is memoryview else memoryview(stream)
+        id, size, value = MESSAGE_HEADER.unpack_from(view, offset)
+        type_ = MESSAGE_TYPES.get(value) or MessageType(value)
+        data = view[(offset+5):(offset+4+size)]   # type is included in size
+        return KailleraMessage.from_view(id, size, type_, data)
 
     def encode(self):
-        return b''.join([
-            self.id.to_bytes(2, types.ORDER),
-            self.size.to_bytes(2, types.ORDER),
-            int(self.type_.value).to_bytes(1, types.ORDER),
-            self.data
-        ])
+        return MESSAGE_HEADER.pack(self.id, self.size, self.type_.value) \
+            + self.data
 
 
 class ChatGlobal(KailleraMessage):
+    __slots__ = ()
+
     def __init__(self, message: str, username: str = '', id: int = None):
         super().__init__(id=id, type_=MessageType.CHAT_GLOBAL, data=b''.join([
             types.stringz(username),
@@ -66,6 +71,8 @@ class ChatGlobal(KailleraMessage):
 
 
 class ClientAck(KailleraMessage):
+    __slots__ = ()
+
     def __init__(self, id: int = None):
         values = [types.uint(i, 4) for i in range(4)]
         data = b'\0' + b''.join(values)
@@ -73,6 +80,8 @@ class ClientAck(KailleraMessage):
 
 
 class ClientInfo(KailleraMessage):
+    __slots__ = ()
+
     def __init__(self, username: str, client_name: str,
                  connection_type: int = 1, id: int = None):
         super().__init__(id=id, type_=MessageType.CLIENT_INFO, data=b''.join([
@@ -83,6 +92,8 @@ class ClientInfo(KailleraMessage):
 
 
 class ClientQuit(KailleraMessage):
+    __slots__ = ()
+
     def __init__(self, message: str, id: int = None):
         super().__init__(id=id, type_=MessageType.CLIENT_QUIT, data=b''.join([
             bytes([0, 255, 255]),
@@ -90,6 +101,89 @@ class ClientQuit(KailleraMessage):
         ]))
 
 
+class KeepAlive(KailleraMessage):
+    __slots__ = ()
+
+    def __init__(self, id: int = None):
+        super().__init__(id=id, type_=MessageType.KEEP_ALIVE, data=b'\0')
+
+
+class GameCreate(KailleraMessage):
+    __slots__ = ()
+
+    def __init__(self, rom: str, id: int = None):
+        super().__init__(id=id, type_=MessageType.GAME_CREATE, data=b''.join([
+            b'\0',
+            types.stringz(rom),
+            b'\0',
+            types.uint(0xffffffff, 4),
+        ]))
+
+
+class GameJoin(KailleraMessage):
+    __slots__ = ()
+
+    def __init__(self, game_id: int, connection_type: int = 1,
+                 id: int = None):
+        super().__init__(id=id, type_=MessageType.GAME_JOIN, data=b''.join([
+            b'\0',
+            types.uint(game_id, 4),
+            b'\0',
+            types.uint(0, 4),
+            types.uint(0xffff, 2),
+            types.uint(connection_type, 1),
+        ]))
+
+
+class GameQuit(KailleraMessage):
+    __slots__ = ()
+
+    def __init__(self, id: int = None):
+        super().__init__(id=id, type_=MessageType.GAME_QUIT,
+                         data=b'\0' + types.uint(0xffff, 2))
+
+
+class GameStart(KailleraMessage):
+    __slots__ = ()
+
+    def __init__(self, id: int = None):
+        super().__init__(id=id, type_=MessageType.GAME_START,
+                         data=b'\0' + types.uint(0xffff, 2) + b'\xff\xff')
+
+
+class GameReady(KailleraMessage):
+    __slots__ = ()
+
+    def __init__(self, id: int = None):
+        super().__init__(id=id, type_=MessageType.GAME_READY, data=b'\0')
+
+
+class GameDrop(KailleraMessage):
+    __slots__ = ()
+
+    def __init__(self, id: int = None):
+        super().__init__(id=id, type_=MessageType.GAME_DROP, data=b'\0\0')
+
+
+class GameData(KailleraMessage):
+    __slots__ = ()
+
+    def __init__(self, data: bytes, id: int = None):
+        super().__init__(id=id, type_=MessageType.GAME_DATA, data=b''.join([
+            b'\0',
+            types.uint(len(data), 2),
+            data,
+        ]))
+
+
+class GameCache(KailleraMessage):
+    __slots__ = ()
+
+    def __init__(self, slot: int, id: int = None):
+        super().__init__(id=id, type_=MessageType.GAME_CACHE,
+                         data=b'\0' + types.uint(slot, 1))
+
+
 class ServerFullException(Exception):
     pass
 
@@ -128,7 +222,14 @@ class P2PType(Enum):
     UNKNOWN = 100
 
 
+P2P_HEADER = struct.Struct('<BBB')
+P2P_TYPES = {t.value: t for t in P2PType}
+
+
 class P2PMessage(Message):
+    __slots__ = ()
+    id_size = 1
+
     def __init__(self, id: int = None, size: int = 0,
                  type_: P2PType = P2PType.UNKNOWN,
                  data: bytes = b''):
@@ -138,23 +239,21 @@ class P2PMessage(Message):
         return f"{P2PType(self.type_)} (len = {self.size}): {self.data}"
 
     @classmethod
-    def decode(self, stream: bytes) -> Message:
-        id = int(stream[0])
-        size = int(stream[1])
-        type_ = P2PType(int(stream[2]))
-        data = stream[3:(3+size)]   # type is included in size
-        return P2PMessage(id=id, size=size, type_=type_, data=data)
+    def decode(self, stream: bytes, offset: int = 0) -> Message:
+        view = stream if type(stream) is memoryview else memoryview(stream)
+        id, size, value = P2P_HEADER.unpack_from(view, offset)
+        type_ = P2P_TYPES.get(value) or P2PType(value)
+        data = view[(offset+3):(offset+2+size)]   # type is included in size
+        return P2PMessage.from_view(id, size, type_, data)
 
     def encode(self):
-        return b''.join([
-            self.id.to_bytes(1, types.ORDER),
-            self.size.to_bytes(1, types.ORDER),
-            int(self.type_.value).to_bytes(1, types.ORDER),
-            self.data
-        ])
+        return P2P_HEADER.pack(self.id, self.size, self.type_.value) \
+            + self.data
 
 
 class P2PChat(P2PMessage):
+    __slots__ = ()
+
     def __init__(self, message: str, frame: int = 5, id: int = None):
         super().__init__(
             id=id,
@@ -166,6 +265,8 @@ class P2PChat(P2PMessage):
 
 
 class P2PClientAccept(P2PMessage):
+    __slots__ = ()
+
     def __init__(self, id: int = None):
         super().__init__(
             id=id,
@@ -174,6 +275,8 @@ class P2PClientAccept(P2PMessage):
 
 
 class P2PClientExit(P2PMessage):
+    __slots__ = ()
+
     def __init__(self, id: int = None):
         super().__init__(
             id=id,
@@ -181,7 +284,18 @@ class P2PClientExit(P2PMessage):
             data=b'')
 
 
+class P2PPing(P2PMessage):
+    __slots__ = ()
+
+    def __init__(self, probe: int, id: int = None):
+        # the host echoes the data back as is, so it numbers the probe
+        super().__init__(id=id, type_=P2PType.PING_PING,
+                         data=types.uint(probe, 4))
+
+
 class P2PClientRequest(P2PMessage):
+    __slots__ = ()
+
     def __init__(self, username: str, client_name: str, id: int = None):
         super().__init__(id=id, type_=P2PType.CLIENT_REQUEST,
                          data=b''.join([
@@ -1,7 +1,14 @@
-import copy
+import select
 import socket
+import time
 
+import channels
+from deadline import Deadline
 from message import MessageBuffer
+from metrics import NULL, NullMetrics, timed
+from rto import RTOEstimator
+from sockets import Receiver, SocketPool
+from stats import PingStats
 
 import kaillera.models as P2P
 from kaillera.models import (
@@ -12,61 +19,193 @@ from kaillera.models import (
 
 
 class P2PClient:
-    def __init__(self, host: str, port: int, retry: int = 1, timeout: int = 2):
+    def __init__(self, host: str, port: int, retry: int = 3, timeout: int = 2,
+                 pool: SocketPool = None, metrics: NullMetrics = NULL,
+                 recorder: 'capture.Recorder' = None):
         self.host = host
         self.server_port = port
         self.user_port = 0
         self.retry = retry
         self.timeout = timeout
+        self.pool = pool
+        self.mtu = 1400
+        self.metrics = metrics
+        self.recorder = recorder
+
+        # `retry` retransmissions, each waiting one (backed off) RTO, all
+        # within `timeout`, so the first RTO leaves room for the others
+        self.rto = RTOEstimator(initial=timeout / (retry + 1),
+                                max_rto=timeout)
+        self.receiver = Receiver()
 
         self.type_ = P2PMessage
+        # a single send still carries 5 messages, the window only has to
+        # hold a whole batch until it is on the wire
         self.client_buffer = MessageBuffer(manage=True, as_=self.type_,
-                                           meta_size=2)
-        self.server_buffer = MessageBuffer(as_=self.type_, meta_size=2)
+                                           meta_size=2, window=32,
+                                           metrics=metrics)
+        self.server_buffer = MessageBuffer(as_=self.type_, meta_size=2,
+                                           window=64, metrics=metrics)
 
         self.socket = self.__socket_connect(host, self.server_port)
 
-    def send_message(self, message: P2PMessage,
-                     wait: bool = True) -> MessageBuffer:
+    def send_message(self, message: P2PMessage, wait: bool = True,
+                     deadline: Deadline = None) -> MessageBuffer:
         self.client_buffer.add(message)
-        raw = self.__send_raw(self.socket, self.client_buffer.encode(),
-                              wait=wait)
+        raw = self.__send_raw(self.socket,
+                              self.client_buffer.encode(mtu=self.mtu),
+                              wait=wait, deadline=deadline)
 
-        response = MessageBuffer(buffer=raw, as_=self.type_, meta_size=2)
-        [self.server_buffer.add(m) for m in response]
+        response = MessageBuffer.decode_all(raw, as_=self.type_, meta_size=2)
+        [self.server_buffer.add(m) for m in reversed(response)]
         return response
 
-    def connect(self, username: str,
-                client: str) -> tuple[bool, MessageBuffer]:
+    def send_messages(self, messages: list[P2PMessage], wait: bool = True,
+                      deadline: Deadline = None) -> MessageBuffer:
+        responses = MessageBuffer([], as_=self.type_, meta_size=2, window=64)
+        buffer = self.client_buffer
+        for batch in buffer.pack(messages, self.mtu):
+            [buffer.add(message) for message in batch]
+            datagram = buffer.encode(max(len(batch), buffer.tx_size),
+                                     self.mtu)
+            raw = self.__send_raw(self.socket, datagram, wait=wait,
+                                  deadline=deadline)
+
+            response = MessageBuffer.decode_all(raw, as_=self.type_,
+                                                meta_size=2)
+            for message in reversed(response):
+                self.server_buffer.add(message)
+                responses.add(message)
+            # one answered batch shows the peer is there, the rest go out
+            # without waiting, as chat lines after the first always did
+            wait = False
+        return responses
+
+    @timed('connect_ms')
+    def connect(self, username: str, client: str,
+                deadline: Deadline = None) -> tuple[bool, MessageBuffer]:
         join_buffer = MessageBuffer([], as_=self.type_, meta_size=2)
         join_types = [
             P2PType.CLIENT_ACCEPT, P2PType.CLIENT_REJECT, P2PType.PLAYER_CHAT
         ]
 
         request = P2P.P2PClientRequest(username, client)
-        response = self.send_message(request)
+        response = self.send_message(request, deadline=deadline)
 
         attempts = 0
         while type(response) == MessageBuffer and attempts < 3:
             message: P2PMessage
             for message in response:
-                if P2PType(message.type_) in join_types:
+                if message.type_ in join_types:
                     join_buffer.add(message)
 
-                if P2PType(message.type_) == P2PType.CLIENT_ACCEPT:
-                    self.send_message(P2P.P2PClientAccept())
+                if message.type_ == P2PType.CLIENT_ACCEPT:
+                    self.send_message(P2P.P2PClientAccept(),
+                                      deadline=deadline)
                     return [True, join_buffer]
-                elif P2PType(message.type_) == P2PType.CLIENT_REJECT:
+                elif message.type_ == P2PType.CLIENT_REJECT:
                     raise P2PRejectException()
 
             attempts += 1
-            response = self.send_message(copy.deepcopy(request))
+            request = P2P.P2PClientRequest(username, client)
+            response = self.send_message(request, deadline=deadline)
 
         return [False, join_buffer]
 
-    def chat(self, message: str = '', frame: int = 5,
-             wait: bool = True) -> MessageBuffer:
-        return self.send_message(P2P.P2PChat(message, frame), wait=wait)
+    def chat(self, message: str = '', frame: int = 5, wait: bool = True,
+             deadline: Deadline = None) -> MessageBuffer:
+        return self.send_message(P2P.P2PChat(message, frame), wait=wait,
+                                 deadline=deadline)
+
+    @timed('chat_ms')
+    def chat_many(self, messages: list[str], frame: int = 5,
+                  wait: bool = True,
+                  deadline: Deadline = None) -> MessageBuffer:
+        return self.send_messages(
+            [P2P.P2PChat(message, frame) for message in messages],
+            wait=wait, deadline=deadline)
+
+    @timed('ping_ms')
+    def ping(self, count: int = 5, interval: float = 0.02,
+             deadline: Deadline = None) -> PingStats:
+        # probes are paced without waiting for echoes, every datagram also
+        # repeats the probes before it so one lost datagram costs nothing
+        sock = self.socket
+        interval_ns = int(interval * 1e9)
+        timeout_ns = int((self.rto.rto if self.rto.srtt is not None
+                          else self.timeout) * 1e9)
+
+        sent: list[int] = []
+        rtts: list[float] = [None] * count
+        received = 0
+        next_send = time.perf_counter_ns()
+
+        # whatever was collected by the deadline is returned as is
+        stop = next_send + int(deadline.remaining() * 1e9) \
+            if deadline else None
+
+        while received < count:
+            now = time.perf_counter_ns()
+            if stop is not None and now >= stop:
+                break
+
+            if len(sent) < count and now >= next_send:
+                self.client_buffer.add(P2P.P2PPing(len(sent)))
+                datagram = self.client_buffer.encode(mtu=self.mtu)
+                sock.send(datagram)
+                self.metrics.incr('pings_sent')
+                self.metrics.incr('datagrams_sent')
+                self.metrics.incr('sent_bytes', len(datagram))
+                if self.recorder is not None:
+                    self.recorder.record(channels.SENT, channels.P2P, datagram)
+                sent.append(now)
+                next_send = now + interval_ns
+                continue
+
+            wait_until = next_send if len(sent) < count \
+                else sent[-1] + timeout_ns
+            if stop is not None:
+                wait_until = min(wait_until, stop)
+            if now >= wait_until:
+                break
+
+            readable, _, _ = select.select([sock], [], [],
+                                           (wait_until - now) / 1e9)
+            if not readable:
+                continue
+
+            recv = self.receiver.recv_all(sock)
+            recv_time = time.perf_counter_ns()
+            if self.metrics.enabled:
+                self.metrics.incr('datagrams_received', len(recv))
+                self.metrics.incr('received_bytes', sum(map(len, recv)))
+            if self.recorder is not None:
+                for datagram in recv:
+                    self.recorder.record(channels.RECEIVED, channels.P2P,
+                                         datagram)
+
+            response = MessageBuffer.decode_all(recv, as_=self.type_,
+                                                meta_size=2)
+            for message in reversed(response):
+                if message.id in self.server_buffer.messages:
+                    continue
+                self.server_buffer.add(message)
+                if message.type_ != P2PType.PING_ECHO or \
+                        len(message.data) < 4:
+                    continue
+
+                # an echo that only came along with a later reply is timed
+                # by when it got here, game data would have waited as long
+                probe = int.from_bytes(message.data[:4], 'little')
+                if probe < len(sent) and rtts[probe] is None:
+                    rtt = recv_time - sent[probe]
+                    rtts[probe] = rtt / 1e6
+                    received += 1
+                    self.rto.sample(rtt / 1e9)
+                    self.metrics.observe('ping_rtt_ms', rtt / 1e6)
+
+        self.metrics.incr('pings_lost', count - received)
+        return PingStats(rtts)
 
     def disconnect(self) -> MessageBuffer:
         # there will not be a response
@@ -75,30 +214,80 @@ class P2PClient:
     def get_host_info(self, buffer: MessageBuffer) -> tuple[str, str]:
         message: P2PMessage
         for message in buffer:
-            if P2PType(message.type_) == P2PType.CLIENT_ACCEPT:
+            if message.type_ == P2PType.CLIENT_ACCEPT:
                 return list(filter(len, message.data.decode().split('\0')))
 
         return [None, None]
 
+    def close(self):
+        if self.socket and self.pool is not None:
+            self.pool.release(self.socket)
+        elif self.socket:
+            self.socket.close()
+        self.socket = None
+
     def __send_raw(self, client: socket.socket, message: bytes,
-                   retry: bool = False, wait: bool = True) -> bytes:
+                   retry: bool = True, wait: bool = True,
+                   deadline: Deadline = None) -> list[bytes]:
+        # without a deadline the whole exchange, retransmissions and all,
+        # still only gets the one timeout
+        deadline = deadline or Deadline(self.timeout)
+        # anything still queued answers an earlier exchange, it goes before
+        # the send so it can't be taken for this one's reply
+        stale = self.receiver.drain(client)
+        if stale:
+            self.metrics.incr('stale_datagrams', len(stale))
+            if self.recorder is not None:
+                for datagram in stale:
+                    self.recorder.record(channels.RECEIVED, channels.P2P,
+                                         datagram)
+
+        # a retransmission is the same datagram, it still carries the whole
+        # redundancy window so any copy that gets through is enough
         attempts = 0
-        while attempts < self.retry:
-            try:
-                client.sendall(message)
+        while True:
+            timeout = self.rto.rto
+            client.settimeout(deadline.timeout(timeout))
+            sent = time.perf_counter()
+            client.sendall(message)
+            self.metrics.incr('datagrams_sent')
+            self.metrics.incr('sent_bytes', len(message))
+            if self.recorder is not None:
+                self.recorder.record(channels.SENT, channels.P2P, message)
 
-                if wait:
-                    recv, _, _, _ = client.recvmsg(8192)
-                    return recv
-                else:
-                    return b''
+            if not wait:
+                return []
+
+            try:
+                recv = self.receiver.recv_all(client)
             except socket.timeout:
-                if retry and attempts < self.retry:
-                    attempts += 1
-                else:
+                self.metrics.incr('timeouts')
+                if not retry or attempts >= self.retry:
                     raise
+                attempts += 1
+                self.metrics.incr('retransmits')
+                self.rto.backoff()
+                continue
+
+            if self.metrics.enabled:
+                self.metrics.incr('datagrams_received', len(recv))
+                self.metrics.incr('received_bytes', sum(map(len, recv)))
+            if self.recorder is not None:
+                for datagram in recv:
+                    self.recorder.record(channels.RECEIVED, channels.P2P,
+                                         datagram)
+
+            # Karn: a reply to a retransmission can't be timed reliably
+            if not attempts:
+                rtt = time.perf_counter() - sent
+                self.rto.sample(rtt)
+                self.metrics.observe('rtt_ms', rtt * 1000)
+            return recv
 
     def __socket_connect(self, host: str, port: int):
+        if self.pool is not None:
+            return self.pool.acquire(host, port, self.timeout)
+
         attempts = 0
 
         while attempts < self.retry:
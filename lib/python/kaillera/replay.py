@@ -0,0 +1,107 @@
+#!/usr/bin/env python3
+
+import argparse
+import json
+import struct
+import sys
+import time
+from collections import Counter
+
+from capture import KAILLERA, P2P, RECEIVED, Capture
+from message import MessageBuffer
+
+from kaillera.lobby import LobbyState
+from kaillera.models import KailleraMessage, MessageType, P2PMessage
+
+
+CODECS = {
+    KAILLERA: (KailleraMessage, 4),
+    P2P: (P2PMessage, 2),
+}
+
+
+def feed(capture: Capture, models: list = (),
+         materialize: bool = False) -> dict:
+    # received kaillera messages are deduped the way a client does before
+    # they reach the models, anything with an apply(message) will do
+    stats = {'records': 0, 'bytes': 0, 'datagrams': 0, 'messages': 0,
+             'errors': 0}
+    types = Counter()
+    server = MessageBuffer(as_=KailleraMessage, window=64)
+
+    for _, direction, channel, payload in capture:
+        stats['records'] += 1
+        stats['bytes'] += len(payload)
+
+        codec = CODECS.get(channel)
+        if codec is None:
+            # the public channel only carries HELLO and PING text
+            continue
+
+        as_, meta_size = codec
+        try:
+            buffer = MessageBuffer.decode(payload, as_=as_,
+                                          meta_size=meta_size)
+        except (ValueError, IndexError, struct.error):
+            stats['errors'] += 1
+            continue
+
+        stats['datagrams'] += 1
+
+        # a login starts a new session whose ids start over, it is the
+        # newest message only in the datagram that first sends it
+        newest = next(iter(buffer), None)
+        if direction != RECEIVED and newest is not None and \
+                newest.type_ == MessageType.CLIENT_INFO:
+            server = MessageBuffer(as_=KailleraMessage, window=64)
+
+        prefix = 'rx.' if direction == RECEIVED else 'tx.'
+        for message in reversed(buffer):
+            stats['messages'] += 1
+            types[prefix + message.type_.name] += 1
+            if materialize:
+                message.data
+
+            if models and channel == KAILLERA and direction == RECEIVED \
+                    and message.id not in server.messages:
+                server.add(message)
+                for model in models:
+                    model.apply(message)
+
+    stats['types'] = dict(types.most_common())
+    return stats
+
+
+def replay(path: str, models: list = (), materialize: bool = False) -> dict:
+    start = time.perf_counter()
+    with Capture(path) as capture:
+        stats = feed(capture, models, materialize)
+    elapsed = time.perf_counter() - start
+
+    stats['elapsed'] = round(elapsed, 6)
+    stats['msgs_per_sec'] = round(stats['messages'] / max(elapsed, 1e-9))
+    stats['mb_per_sec'] = round(stats['bytes'] / max(elapsed, 1e-9) / 1e6, 2)
+    return stats
+
+
+def main(argv: list[str] = None) -> int:
+    parser = argparse.ArgumentParser(
+        description="Stream a packet capture through the message codec")
+    parser.add_argument('captures', nargs='+')
+    parser.add_argument('--data', action='store_true',
+                        help="also copy out every message's data")
+    parser.add_argument('--lobby', action='store_true',
+                        help="rebuild the lobby state from received messages")
+    args = parser.parse_args(argv)
+
+    for path in args.captures:
+        lobby = LobbyState() if args.lobby else None
+        stats = replay(path, [lobby] if lobby else [], args.data)
+        if lobby:
+            stats['lobby'] = lobby.summary()
+        print(json.dumps(dict(stats, capture=path)), flush=True)
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
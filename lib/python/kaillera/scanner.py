@@ -0,0 +1,129 @@
+#!/usr/bin/env python3
+
+import argparse
+import json
+import socket
+import sys
+import time
+from collections.abc import Iterable, Iterator
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+from io import TextIOBase
+
+import kaillera.client as Kaillera
+import kaillera.models as Models
+from kaillera.models import ServerFullException, ServerNoHelloException
+
+
+DEFAULT_PORT = 27888
+
+
+def parse_target(line: str) -> tuple[str, int]:
+    # accepts 'host:port', 'host port' or a bare host, '#' starts a comment
+    line = line.split('#', 1)[0].strip()
+    if not line:
+        return None
+
+    host, _, port = line.replace(' ', ':').partition(':')
+    return host, int(port.strip(':') or DEFAULT_PORT)
+
+
+def read_targets(stream: TextIOBase) -> Iterator[tuple[str, int]]:
+    for line in stream:
+        try:
+            target = parse_target(line)
+        except ValueError:
+            continue
+
+        if target:
+            yield target
+
+
+def check_hello(client: Kaillera.Client) -> str:
+    # the server answered pings, so whatever goes wrong here is the hello's
+    try:
+        client.hello()
+    except ServerFullException:
+        return 'FULL'
+    except ServerNoHelloException:
+        return 'NO_HELLO'
+    except socket.timeout:
+        return 'TIMEOUT'
+    except Exception as e:
+        return f'ERROR: {type(e).__name__}'
+
+    # the hello took a user slot, left alone it would stay taken until the
+    # server times it out, and a scan does that to every server it checks
+    try:
+        client.post(Models.ClientQuit(''))
+    except OSError:
+        pass
+    return 'OK'
+
+
+def probe(host: str, port: int, count: int = 3, timeout: int = 2,
+          hello: bool = False) -> dict:
+    result = {'host': host, 'port': port, 'success': False}
+    client = None
+    start = time.time()
+
+    try:
+        client = Kaillera.Client(host, port, timeout=timeout)
+        latency, drops = client.ping(count)
+        result.update({'success': True, 'latency': latency, 'loss': drops})
+
+        if hello:
+            result['hello'] = check_hello(client)
+    except Exception as e:
+        result['error'] = type(e).__name__
+    finally:
+        if client:
+            client.close()
+
+    result['elapsed'] = int((time.time() - start) * 1000)
+    return result
+
+
+def scan(targets: Iterable[tuple[str, int]], workers: int = 64,
+         **kwargs) -> Iterator[dict]:
+    # only a bounded number of probes is ever queued, so memory stays flat
+    # no matter how long the server list is
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        pending = set()
+        for host, port in targets:
+            if len(pending) >= workers * 2:
+                done, pending = wait(pending, return_when=FIRST_COMPLETED)
+                yield from (f.result() for f in done)
+            pending.add(pool.submit(probe, host, port, **kwargs))
+
+        while pending:
+            done, pending = wait(pending, return_when=FIRST_COMPLETED)
+            yield from (f.result() for f in done)
+
+
+def main(argv: list[str] = None) -> int:
+    parser = argparse.ArgumentParser(
+        description="Probe a list of kaillera servers and print JSON lines")
+    parser.add_argument('servers', nargs='?', default='-',
+                        help="file with one host:port per line, '-' = stdin")
+    parser.add_argument('-w', '--workers', type=int, default=64)
+    parser.add_argument('-c', '--count', type=int, default=3)
+    parser.add_argument('-t', '--timeout', type=float, default=2)
+    parser.add_argument('--hello', action='store_true',
+                        help="also check the server accepts a HELLO")
+    args = parser.parse_args(argv)
+
+    stream = sys.stdin if args.servers == '-' else open(args.servers)
+    try:
+        results = scan(read_targets(stream), workers=args.workers,
+                       count=args.count, timeout=args.timeout,
+                       hello=args.hello)
+        for result in results:
+            print(json.dumps(result), flush=True)
+    finally:
+        if stream is not sys.stdin:
+            stream.close()
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,213 @@
+#!/usr/bin/env python3
+
+import argparse
+import asyncio
+import json
+import sys
+import time
+from collections.abc import Callable
+
+from timers import Timer, TimerWheel
+
+import kaillera.models as Kaillera
+from kaillera.asyncclient import AsyncClient
+from kaillera.client import ConnType
+from kaillera.models import KailleraMessage, MessageType
+from kaillera.scanner import read_targets
+
+
+Handler = Callable[['LobbySession', KailleraMessage], None]
+
+
+class LobbySession:
+    def __init__(self, host: str, port: int, wheel: TimerWheel,
+                 username: str = 'smash64.online',
+                 client_name: str = 'lobby-bot',
+                 conn: ConnType = ConnType.LAN,
+                 keepalive: float = 20, idle_timeout: float = 90,
+                 timeout: int = 2):
+        self.host = host
+        self.port = port
+        self.wheel = wheel
+        self.username = username
+        self.client_name = client_name
+        self.conn = conn
+        self.keepalive = keepalive
+        self.idle_timeout = idle_timeout
+
+        self.client = AsyncClient(host, port, timeout=timeout)
+
+        # handlers registered for None see every message
+        self.handlers: dict[MessageType, list[Handler]] = {}
+        self.timer: Timer = None
+        self.task: asyncio.Task = None
+        self.joined = False
+        self.closed = False
+        self.last_seen: float = None
+
+        self.on(MessageType.SERVER_ACK, self.__ack)
+
+    def __repr__(self):
+        state = 'closed' if self.closed else \
+            'joined' if self.joined else 'new'
+        return f"LobbySession({self.host}:{self.port}, {state})"
+
+    def on(self, type_: MessageType, handler: Handler) -> Handler:
+        self.handlers.setdefault(type_, []).append(handler)
+        return handler
+
+    def dispatch(self, message: KailleraMessage):
+        for handler in self.handlers.get(message.type_, ()):
+            handler(self, message)
+        for handler in self.handlers.get(None, ()):
+            handler(self, message)
+
+    def send(self, message: KailleraMessage):
+        self.client.post(message)
+        # anything sent keeps the session alive, the keepalive only goes
+        # out after a quiet interval
+        self.timer = self.wheel.reschedule(self.timer, self.keepalive)
+
+    def chat(self, message: str):
+        self.send(Kaillera.ChatGlobal(message))
+
+    async def start(self):
+        await self.client.connect(self.username, self.client_name, self.conn)
+        self.joined = True
+        self.last_seen = time.monotonic()
+        self.timer = self.wheel.schedule(self.keepalive, self.__keepalive)
+
+        # the login replies are the first state of the lobby, its acks were
+        # already answered by connect()
+        for message in reversed(self.client.server_buffer):
+            if message.type_ != MessageType.SERVER_ACK:
+                self.dispatch(message)
+
+    async def run(self):
+        self.task = asyncio.current_task()
+        try:
+            if not self.joined:
+                await self.start()
+
+            while not self.closed:
+                # a server that stays quiet this long has dropped us
+                messages = await self.client.receive(self.idle_timeout)
+                self.last_seen = time.monotonic()
+                for message in messages:
+                    self.dispatch(message)
+        except asyncio.CancelledError:
+            if not self.closed:
+                raise
+        finally:
+            self.close()
+
+    def close(self, message: str = ''):
+        if self.closed:
+            return
+
+        self.closed = True
+        self.wheel.cancel(self.timer)
+        if self.joined and self.client.priv_sock:
+            try:
+                self.client.post(Kaillera.ClientQuit(message))
+            except OSError:
+                pass
+        self.client.close()
+
+        if self.task and self.task is not asyncio.current_task():
+            self.task.cancel()
+
+    def __ack(self, session: 'LobbySession', message: KailleraMessage):
+        # servers keep pinging after login and drop whoever stops answering
+        self.send(Kaillera.ClientAck())
+
+    def __keepalive(self):
+        if not self.closed:
+            self.send(Kaillera.KeepAlive())
+
+
+class Lobby:
+    def __init__(self, resolution: float = 0.5):
+        # a single wheel and ticker drive the timers of every session
+        self.wheel = TimerWheel(resolution)
+        self.sessions: list[LobbySession] = []
+
+    def add(self, host: str, port: int, **kwargs) -> LobbySession:
+        session = LobbySession(host, port, self.wheel, **kwargs)
+        self.sessions.append(session)
+        return session
+
+    async def tick(self):
+        while True:
+            await asyncio.sleep(self.wheel.resolution)
+            self.wheel.advance()
+
+    async def run(self) -> list:
+        # a failing session ends on its own, its exception is returned
+        ticker = asyncio.ensure_future(self.tick())
+        try:
+            return await asyncio.gather(
+                *[session.run() for session in self.sessions],
+                return_exceptions=True)
+        finally:
+            ticker.cancel()
+
+    def close(self):
+        for session in self.sessions:
+            session.close()
+
+
+def print_message(session: LobbySession, message: KailleraMessage):
+    print(json.dumps({
+        'host': session.host,
+        'port': session.port,
+        'type': message.type_.name,
+        'size': message.size,
+    }), flush=True)
+
+
+async def watch(targets: list[tuple[str, int]], duration: float = None,
+                **kwargs) -> list:
+    lobby = Lobby()
+    for host, port in targets:
+        lobby.add(host, port, **kwargs).on(None, print_message)
+
+    if duration:
+        asyncio.get_running_loop().call_later(duration, lobby.close)
+    return await lobby.run()
+
+
+def main(argv: list[str] = None) -> int:
+    parser = argparse.ArgumentParser(
+        description="Stay in kaillera lobbies and print messages as JSON")
+    parser.add_argument('servers', nargs='?', default='-',
+                        help="file with one host:port per line, '-' = stdin")
+    parser.add_argument('-u', '--username', default='smash64.online')
+    parser.add_argument('-k', '--keepalive', type=float, default=20)
+    parser.add_argument('-d', '--duration', type=float, default=None,
+                        help="leave the lobbies after this many seconds")
+    args = parser.parse_args(argv)
+
+    stream = sys.stdin if args.servers == '-' else open(args.servers)
+    try:
+        targets = list(read_targets(stream))
+    finally:
+        if stream is not sys.stdin:
+            stream.close()
+
+    try:
+        results = asyncio.run(watch(targets, args.duration,
+                                    username=args.username,
+                                    keepalive=args.keepalive))
+    except KeyboardInterrupt:
+        return 0
+
+    for (host, port), result in zip(targets, results):
+        if isinstance(result, BaseException):
+            print(json.dumps({'host': host, 'port': port,
+                              'error': type(result).__name__}), flush=True)
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -1,12 +1,13 @@
 from __future__ import annotations
-import copy
 import enum
-from typing import TypeVar, Union
 
-import primitives as types
+from metrics import NULL, NullMetrics
 
 
 class Message:
+    __slots__ = ('id', 'size', 'type_', '_data')
+    id_size = 2
+
     def __init__(self, id: int = None, size: int = 0,
                  type_: enum.Enum = None, data: bytes = b''):
         if type_ is None:
@@ -20,10 +21,36 @@ class Message:
     def __repr__(self):
         return f"{self.type_} (len = {self.size}): {self.data}"
 
+    @property
+    def data(self) -> bytes:
+        # decoded messages hold a view into the datagram until first read
+        if type(self._data) is memoryview:
+            self._data = self._data.tobytes()
+        return self._data
+
+    @data.setter
+    def data(self, value: bytes):
+        self._data = value
+
+    def __getstate__(self):
+        # views can't be copied or pickled, materialize them first
+        self.data
+        return None, {k: getattr(self, k) for k in Message.__slots__}
+
     @classmethod
-    def decode(self, stream: bytes) -> bytes:
+    def decode(self, stream: bytes, offset: int = 0) -> bytes:
         raise NotImplementedError
 
+    @classmethod
+    def from_view(cls, id: int, size: int, type_: enum.Enum,
+                  view: memoryview) -> Message:
+        message = cls.__new__(cls)
+        message.id = id
+        message.size = size
+        message.type_ = type_
+        message._data = view
+        return message
+
     def encode(self) -> bytes:
         raise NotImplementedError
 
@@ -36,72 +63,168 @@ class Message:
 
 
 class MessageBuffer:
-    T = TypeVar("T")
-
-    def __init__(self, buffer: Union[list[T], bytes] = [], tx_size: int = 5,
-                 manage: bool = False, as_: T = Message, meta_size: int = 4):
+    def __init__(self, buffer: list[Message] | bytes = [], tx_size: int = 5,
+                 manage: bool = False, as_: type[Message] = Message,
+                 meta_size: int = 4, window: int = None,
+                 metrics: NullMetrics = NULL):
         self.manage = manage
         self.tx_size = tx_size
         self.type_ = as_
         self.meta_size = meta_size
-
-        if type(buffer) == bytes:
-            self.buffer = self.decode(
-                copy.deepcopy(buffer), manage, as_, self.meta_size)
-        else:
-            self.buffer = copy.deepcopy(buffer)
+        self.window = window
+        self.metrics = metrics
+
+        # ids are unsigned and wrap around at the size of the id field
+        self.id_mask = (1 << (8 * as_.id_size)) - 1
+        self.last_id = None
+
+        # indexed by id and kept oldest first, so both dedupe and eviction
+        # are O(1) without ever sorting
+        self.messages: dict[int, Message] = {}
+
+        # wire bytes of every message this buffer sends, so a message is
+        # only encoded once no matter how often it is retransmitted
+        self.encoded: dict[int, bytes] = {}
+        self.datagram = bytearray()
+
+        if isinstance(buffer, (bytes, bytearray, memoryview)):
+            decoded = self.decode(buffer, manage, as_, self.meta_size)
+            self.messages = decoded.messages
+            self.last_id = decoded.last_id
+        elif buffer:
+            # only needed when copying messages in, keep it off cold starts
+            import copy
+            for message in reversed(copy.deepcopy(buffer)):
+                self.add(message, manage=False)
+
+    @property
+    def buffer(self) -> list[Message]:
+        return list(self)
 
     def __getitem__(self, item):
         return self.buffer[item]
 
     def __iter__(self):
-        return iter(self.buffer)
+        return reversed(self.messages.values())
 
     def __len__(self):
-        return len(self.buffer)
+        return len(self.messages)
 
     def __repr__(self):
-        return f"Messages: {len(self.buffer)}:\n" + '\n'.join([
-            f"  {m.id:0>3}: {m}" for m in self.buffer
+        return f"Messages: {len(self)}:\n" + '\n'.join([
+            f"  {m.id:0>3}: {m}" for m in self
         ])
 
     def __reversed__(self):
-        return iter(reversed(self.buffer))
+        return iter(self.messages.values())
 
     def add(self, message: Message, manage: bool = None) -> int:
-        self.buffer.sort(key=lambda m: m.id, reverse=True)
         manage = manage if manage is not None else self.manage
 
         if manage:
-            message.id = self.buffer[0].id + 1 if self.buffer else 0
-
-        if not any(m.id == message.id for m in self.buffer):
-            self.buffer.insert(0, message)
+            last_id = self.last_id
+            message.id = (last_id + 1) & self.id_mask \
+                if last_id is not None else 0
+            # only an unbounded buffer can wrap onto an id it still holds
+            self.messages.pop(message.id, None)
+            self.encoded[message.id] = message.encode()
+        elif message.id in self.messages:
+            return message.id
+
+        self.messages[message.id] = message
+        self.last_id = message.id
+
+        if self.metrics.enabled:
+            # duplicates never get here, so received counts are unique
+            prefix = 'tx.' if manage else 'rx.'
+            self.metrics.incr(prefix + message.type_.name)
+
+        if self.window and len(self.messages) > self.window:
+            oldest = next(iter(self.messages))
+            del self.messages[oldest]
+            self.encoded.pop(oldest, None)
         return message.id
 
     @classmethod
     def decode(self, stream: bytes, manage: bool = False,
-               as_: T = Message, meta_size: int = 4) -> MessageBuffer:
+               as_: type[Message] = Message,
+               meta_size: int = 4) -> MessageBuffer:
         messages = []
-        count = int.from_bytes(stream[0:1], types.ORDER)
+        buffer = MessageBuffer(tx_size=0, manage=manage, as_=as_,
+                               meta_size=meta_size)
+        if not stream:
+            return buffer
+
+        # every message is decoded in place over a single view, nothing is
+        # copied until a message's data is actually read
+        view = memoryview(stream)
+        count = view[0]
 
         offset = 1
         message: Message
         for _ in range(count):
-            message = as_.decode(stream[offset:])
+            message = as_.decode(view, offset)
             messages.append(message)
             offset = offset + meta_size + message.size
 
-        return MessageBuffer(messages, tx_size=count, manage=manage, as_=as_)
-
-    def encode(self) -> bytes:
-        messages = []
-        size = max([len(self.buffer), self.tx_size])
-        self.buffer.sort(key=lambda m: m.id, reverse=True)
+        # messages are sent newest first
+        buffer.tx_size = count
+        buffer.messages = {m.id: m for m in reversed(messages)}
+        buffer.last_id = messages[0].id if messages else None
+        return buffer
 
+    @classmethod
+    def decode_all(self, datagrams: list[bytes], as_: type[Message] = Message,
+                   meta_size: int = 4) -> MessageBuffer:
+        # datagrams arrive oldest first and their windows overlap
+        if len(datagrams) == 1:
+            return self.decode(datagrams[0], as_=as_, meta_size=meta_size)
+
+        buffer = MessageBuffer(tx_size=0, as_=as_, meta_size=meta_size)
+        for datagram in datagrams:
+            for message in reversed(self.decode(datagram, as_=as_,
+                                                meta_size=meta_size)):
+                buffer.add(message)
+
+        buffer.tx_size = len(buffer)
+        return buffer
+
+    def pack(self, messages: list[Message],
+             mtu: int = 1400) -> list[list[Message]]:
+        # split into runs that each fit one datagram next to the count byte,
+        # a run never outgrows the window or it would be evicted unsent
+        limit = min(self.window or 255, 255)
+        batches, batch, size = [], [], 1
+        for message in messages:
+            wire = self.meta_size + message.size
+            if batch and (size + wire > mtu or len(batch) >= limit):
+                batches.append(batch)
+                batch, size = [], 1
+            batch.append(message)
+            size += wire
+
+        if batch:
+            batches.append(batch)
+        return batches
+
+    def encode(self, tx_size: int = None, mtu: int = None) -> bytes:
+        encoded = self.encoded
+        datagram = self.datagram
+        datagram[:] = b'\0'
+
+        count = 0
         message: Message
-        for _, message in zip(range(size), self.buffer):
-            messages.append(message.encode())
-
-        count = len(messages).to_bytes(1, types.ORDER)
-        return count + b''.join(messages)
+        for _, message in zip(range(min(tx_size or self.tx_size, 255)), self):
+            wire = encoded.get(message.id)
+            if wire is None:
+                wire = encoded[message.id] = message.encode()
+            # redundant older messages only ride along while there is room
+            if mtu and count and len(datagram) + len(wire) > mtu:
+                break
+            datagram += wire
+            count += 1
+
+        datagram[0] = count
+        if self.metrics.enabled:
+            self.metrics.incr('encoded_messages', count)
+        return bytes(datagram)
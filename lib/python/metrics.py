@@ -0,0 +1,168 @@
+from __future__ import annotations
+import functools
+import json
+import os
+import sys
+import time
+from io import TextIOBase
+
+# CloudWatch takes at most 100 values for a single metric in one record
+EMF_MAX_VALUES = 100
+
+
+class Timer:
+    __slots__ = ('metrics', 'name', 'start')
+
+    def __init__(self, metrics: Metrics, name: str):
+        self.metrics = metrics
+        self.name = name
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        self.metrics.observe(self.name,
+                             (time.perf_counter() - self.start) * 1000)
+
+
+class NullTimer:
+    __slots__ = ()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        pass
+
+
+class NullMetrics:
+    # the default everywhere, hot paths pay for a method call and nothing else
+    enabled = False
+    timer_ = NullTimer()
+
+    def incr(self, name: str, value: int = 1):
+        pass
+
+    def observe(self, name: str, value: float):
+        pass
+
+    def timer(self, name: str) -> NullTimer:
+        return self.timer_
+
+    def put(self, key: str, value: object):
+        pass
+
+    def flush(self, dimensions: dict = None, properties: dict = None):
+        pass
+
+
+NULL = NullMetrics()
+
+
+class Metrics(NullMetrics):
+    enabled = True
+
+    def __init__(self, namespace: str = 'serverless-tools'):
+        self.namespace = namespace
+        self.counters: dict[str, int] = {}
+        self.histograms: dict[str, list[float]] = {}
+        self.properties: dict[str, object] = {}
+
+    def incr(self, name: str, value: int = 1):
+        self.counters[name] = self.counters.get(name, 0) + value
+
+    def observe(self, name: str, value: float):
+        values = self.histograms.get(name)
+        if values is None:
+            values = self.histograms[name] = []
+        values.append(value)
+
+    def timer(self, name: str) -> Timer:
+        return Timer(self, name)
+
+    def put(self, key: str, value: object):
+        self.properties[key] = value
+
+    def snapshot(self) -> dict:
+        return {'counters': dict(self.counters),
+                'histograms': {k: list(v) for k, v in self.histograms.items()}}
+
+    def reset(self):
+        self.counters.clear()
+        self.histograms.clear()
+        self.properties.clear()
+
+    def flush(self, dimensions: dict = None, properties: dict = None):
+        self.reset()
+
+
+def timed(name: str):
+    # times a method into the `metrics` of the object it is called on
+    def decorate(method):
+        @functools.wraps(method)
+        def wrapper(self, *args, **kwargs):
+            with self.metrics.timer(name):
+                return method(self, *args, **kwargs)
+        return wrapper
+    return decorate
+
+
+def unit(name: str) -> str:
+    if name.endswith('_ms'):
+        return 'Milliseconds'
+    elif name.endswith('_bytes'):
+        return 'Bytes'
+    return 'Count'
+
+
+class EMFMetrics(Metrics):
+    def __init__(self, namespace: str = 'serverless-tools',
+                 stream: TextIOBase = None):
+        super().__init__(namespace)
+        # lambda ships stdout to CloudWatch Logs, which extracts the metrics
+        self.stream = stream
+
+    def record(self, dimensions: dict = None,
+               properties: dict = None) -> dict:
+        dimensions = dimensions or {}
+        values = dict(self.counters)
+        values.update({k: v[-EMF_MAX_VALUES:]
+                       for k, v in self.histograms.items()})
+
+        record = {
+            '_aws': {
+                'Timestamp': int(time.time() * 1000),
+                'CloudWatchMetrics': [{
+                    'Namespace': self.namespace,
+                    'Dimensions': [list(dimensions)],
+                    'Metrics': [{'Name': k, 'Unit': unit(k)}
+                                for k in values],
+                }],
+            },
+        }
+        # properties are searchable in the logs without being dimensions,
+        # which keeps high cardinality values like hosts off the bill
+        record.update(self.properties)
+        record.update(properties or {})
+        record.update({k: str(v) for k, v in dimensions.items()})
+        record.update(values)
+        return record
+
+    def flush(self, dimensions: dict = None, properties: dict = None):
+        if self.counters or self.histograms:
+            stream = self.stream or sys.stdout
+            stream.write(json.dumps(self.record(dimensions, properties)))
+            stream.write('\n')
+            stream.flush()
+        self.reset()
+
+
+def from_env(prefix: str = 'METRICS') -> NullMetrics:
+    sink = os.environ.get(f'{prefix}_SINK', 'none').lower()
+    namespace = os.environ.get(f'{prefix}_NAMESPACE', 'serverless-tools')
+    if sink == 'emf':
+        return EMFMetrics(namespace)
+    elif sink == 'memory':
+        return Metrics(namespace)
+    return NULL
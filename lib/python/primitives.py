@@ -19,3 +19,26 @@ def stringz(data):
 
 def uint(data: int, size: int = 1, order: str = ORDER):
     return data.to_bytes(size, order)
+
+
+class Reader:
+    __slots__ = ('data', 'offset')
+
+    def __init__(self, data: bytes, offset: int = 0):
+        self.data = data
+        self.offset = offset
+
+    def string(self) -> str:
+        end = self.data.index(b'\0', self.offset)
+        value = self.data[self.offset:end].decode(errors='replace')
+        self.offset = end + 1
+        return value
+
+    def uint(self, size: int = 1, order: str = ORDER) -> int:
+        end = self.offset + size
+        if end > len(self.data):
+            raise ValueError(f"need {size} bytes at {self.offset}")
+
+        value = int.from_bytes(self.data[self.offset:end], order)
+        self.offset = end
+        return value
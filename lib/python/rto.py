@@ -0,0 +1,42 @@
+from __future__ import annotations
+
+
+class RTOEstimator:
+    # RFC 6298 gains
+    alpha = 1 / 8
+    beta = 1 / 4
+    k = 4
+
+    def __init__(self, initial: float = 1, min_rto: float = 0.2,
+                 max_rto: float = 2, granularity: float = 0.001):
+        # min_rto is well below the RFC's 1s, these are game servers where
+        # a whole login is expected to take a couple of round trips
+        self.min_rto = min_rto
+        self.max_rto = max_rto
+        self.granularity = granularity
+
+        self.srtt: float | None = None
+        self.rttvar: float | None = None
+        self.rto = self.clamp(initial)
+
+    def __repr__(self):
+        return f"RTOEstimator(srtt={self.srtt}, rto={self.rto:.3f})"
+
+    def clamp(self, rto: float) -> float:
+        return min(max(rto, self.min_rto), self.max_rto)
+
+    def sample(self, rtt: float):
+        # callers follow Karn's rule and never sample a retransmission
+        if self.srtt is None:
+            self.srtt = rtt
+            self.rttvar = rtt / 2
+        else:
+            self.rttvar = (1 - self.beta) * self.rttvar \
+                + self.beta * abs(self.srtt - rtt)
+            self.srtt = (1 - self.alpha) * self.srtt + self.alpha * rtt
+
+        self.rto = self.clamp(
+            self.srtt + max(self.granularity, self.k * self.rttvar))
+
+    def backoff(self):
+        self.rto = self.clamp(self.rto * 2)
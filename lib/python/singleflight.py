@@ -0,0 +1,97 @@
+from __future__ import annotations
+import asyncio
+from collections.abc import Awaitable, Callable, Hashable, Iterable
+
+
+class SingleFlight:
+    def __init__(self):
+        self.flights: dict[Hashable, asyncio.Future] = {}
+        self.calls = 0
+        self.shared = 0
+
+    def __len__(self):
+        return len(self.flights)
+
+    def __contains__(self, key: Hashable) -> bool:
+        return key in self.flights
+
+    async def do(self, key: Hashable,
+                 call: Callable[[], Awaitable[object]]) -> object:
+        # callers asking for a key already in flight wait for that call
+        # instead of making their own, the result or error goes to everyone
+        future = self.flights.get(key)
+        if future is None:
+            self.calls += 1
+            future = asyncio.ensure_future(call())
+            self.flights[key] = future
+            future.add_done_callback(lambda done: self.__land(key, done))
+        else:
+            self.shared += 1
+
+        # a caller giving up must not cancel the call for the others
+        return await asyncio.shield(future)
+
+    def __land(self, key: Hashable, future: asyncio.Future):
+        if self.flights.get(key) is future:
+            del self.flights[key]
+
+
+class KeyedLimiter:
+    def __init__(self, limit: int = 2):
+        self.limit = limit
+        # key -> [semaphore, holders and waiters], dropped once unused
+        self.entries: dict[Hashable, list] = {}
+
+    def __len__(self):
+        return len(self.entries)
+
+    async def acquire(self, key: Hashable):
+        entry = self.entries.get(key)
+        if entry is None:
+            entry = self.entries[key] = [asyncio.Semaphore(self.limit), 0]
+
+        entry[1] += 1
+        try:
+            await entry[0].acquire()
+        except BaseException:
+            self.__leave(key, entry)
+            raise
+
+    def release(self, key: Hashable):
+        entry = self.entries[key]
+        entry[0].release()
+        self.__leave(key, entry)
+
+    def hold(self, keys: Iterable[Hashable]) -> Held:
+        return Held(self, keys)
+
+    def __leave(self, key: Hashable, entry: list):
+        entry[1] -= 1
+        if not entry[1]:
+            del self.entries[key]
+
+
+class Held:
+    def __init__(self, limiter: KeyedLimiter, keys: Iterable[Hashable]):
+        # always taken in the same order, so two holders of overlapping
+        # keys can't each wait on the other
+        self.limiter = limiter
+        self.keys = sorted(set(keys), key=repr)
+        self.acquired: list[Hashable] = []
+
+    async def __aenter__(self):
+        try:
+            for key in self.keys:
+                await self.limiter.acquire(key)
+                self.acquired.append(key)
+        except BaseException:
+            self.release()
+            raise
+        return self
+
+    async def __aexit__(self, *exc):
+        self.release()
+
+    def release(self):
+        while self.acquired:
+            self.limiter.release(self.acquired.pop())
@@ -0,0 +1,92 @@
+import socket
+
+
+class SocketPool:
+    def __init__(self, size: int = 4):
+        self.size = size
+        self.idle: list[socket.socket] = []
+
+    def __len__(self):
+        return len(self.idle)
+
+    def acquire(self, host: str, port: int,
+                timeout: float = None) -> socket.socket:
+        try:
+            # a single pop, threads sharing the pool can't take the same one
+            sock = self.idle.pop()
+        except IndexError:
+            sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+
+        try:
+            # connecting again replaces the previous peer, anything it sent
+            # that is still queued has to go before the socket is handed out
+            sock.connect((host, port))
+            self.drain(sock)
+            sock.settimeout(timeout)
+        except Exception:
+            sock.close()
+            raise
+        return sock
+
+    def release(self, sock: socket.socket):
+        if sock.fileno() == -1:
+            return
+
+        if len(self.idle) < self.size:
+            self.idle.append(sock)
+        else:
+            sock.close()
+
+    def close(self):
+        while self.idle:
+            self.idle.pop().close()
+
+    @staticmethod
+    def drain(sock: socket.socket, limit: int = 64) -> int:
+        # bounded, a peer that never stops sending can't hold up acquire
+        drained = 0
+        sock.setblocking(False)
+        for _ in range(limit):
+            try:
+                sock.recv(65535)
+                drained += 1
+            except BlockingIOError:
+                break
+            except ConnectionRefusedError:
+                # a pending icmp error from the previous peer, discard it
+                continue
+        return drained
+
+
+class Receiver:
+    def __init__(self, size: int = 65535, limit: int = 64):
+        # one buffer per client, large enough for any datagram
+        self.buffer = bytearray(size)
+        self.view = memoryview(self.buffer)
+        self.limit = limit
+
+    def recv_all(self, sock: socket.socket) -> list[bytes]:
+        # waits for the first datagram as long as the socket's timeout says,
+        # then takes whatever else is already queued without waiting
+        size = sock.recv_into(self.buffer)
+
+        # decoding is lazy over views, each datagram needs its own copy
+        # before the buffer is reused
+        return [bytes(self.view[:size])] + self.drain(sock, self.limit - 1)
+
+    def drain(self, sock: socket.socket, limit: int = None) -> list[bytes]:
+        # only what is already queued, never waits
+        limit = self.limit if limit is None else limit
+        datagrams = []
+        timeout = sock.gettimeout()
+        sock.settimeout(0)
+        try:
+            while len(datagrams) < limit:
+                try:
+                    size = sock.recv_into(self.buffer)
+                except (BlockingIOError, ConnectionRefusedError):
+                    break
+                datagrams.append(bytes(self.view[:size]))
+        finally:
+            sock.settimeout(timeout)
+        return datagrams
@@ -0,0 +1,124 @@
+from __future__ import annotations
+import math
+
+
+def percentile(values: list[float], pct: float) -> float | None:
+    # nearest-rank over an already sorted list
+    if not values:
+        return None
+
+    rank = max(math.ceil(pct / 100 * len(values)) - 1, 0)
+    return values[min(rank, len(values) - 1)]
+
+
+class PingStats:
+    def __init__(self, rtts: list[float | None]):
+        # round trip times in milliseconds, None for a lost probe
+        self.rtts = rtts
+        self.sent = len(rtts)
+
+        received = [rtt for rtt in rtts if rtt is not None]
+        ordered = sorted(received)
+        self.received = len(received)
+        self.lost = self.sent - self.received
+
+        self.min = ordered[0] if ordered else None
+        self.max = ordered[-1] if ordered else None
+        self.avg = sum(ordered) / len(ordered) if ordered else None
+        self.p50 = percentile(ordered, 50)
+        self.p95 = percentile(ordered, 95)
+
+        # mean variation between consecutive replies, as in RFC 3550
+        deltas = [abs(b - a) for a, b in zip(received, received[1:])]
+        self.jitter = sum(deltas) / len(deltas) if deltas else \
+            (0.0 if received else None)
+
+    def __repr__(self):
+        return (f"{self.received}/{self.sent} replies, "
+                f"min/avg/max = {self.min}/{self.avg}/{self.max} ms")
+
+    def as_dict(self, digits: int = 3) -> dict:
+        def round_(value):
+            return round(value, digits) if value is not None else None
+
+        return {
+            'sent': self.sent,
+            'received': self.received,
+            'loss': self.lost,
+            'min': round_(self.min),
+            'avg': round_(self.avg),
+            'p50': round_(self.p50),
+            'p95': round_(self.p95),
+            'max': round_(self.max),
+            'jitter': round_(self.jitter),
+        }
+
+
+class Histogram:
+    def __init__(self, growth: float = 1.05, floor: float = 0.01):
+        # log buckets, every value is kept to within `growth` of itself and
+        # histograms with the same layout merge by adding up counts
+        self.growth = growth
+        self.floor = floor
+        self.scale = math.log(growth)
+
+        self.counts: dict[int, int] = {}
+        self.count = 0
+        self.total = 0.0
+        self.min: float | None = None
+        self.max: float | None = None
+
+    def __repr__(self):
+        return f"Histogram(count={self.count}, p50={self.percentile(50)})"
+
+    def record(self, value: float):
+        index = int(math.log(max(value, self.floor) / self.floor)
+                    / self.scale)
+        self.counts[index] = self.counts.get(index, 0) + 1
+        self.count += 1
+        self.total += value
+        self.min = value if self.min is None else min(self.min, value)
+        self.max = value if self.max is None else max(self.max, value)
+
+    def merge(self, other: Histogram) -> Histogram:
+        if (other.growth, other.floor) != (self.growth, self.floor):
+            raise ValueError("histograms have different buckets")
+
+        for index, count in other.counts.items():
+            self.counts[index] = self.counts.get(index, 0) + count
+        self.count += other.count
+        self.total += other.total
+        if other.min is not None:
+            self.min = other.min if self.min is None \
+                else min(self.min, other.min)
+            self.max = other.max if self.max is None \
+                else max(self.max, other.max)
+        return self
+
+    def percentile(self, pct: float) -> float | None:
+        # nearest rank, reported as the upper edge of its bucket
+        if not self.count:
+            return None
+
+        rank = max(math.ceil(pct / 100 * self.count), 1)
+        seen = 0
+        for index in sorted(self.counts):
+            seen += self.counts[index]
+            if seen >= rank:
+                upper = self.floor * self.growth ** (index + 1)
+                return min(max(upper, self.min), self.max)
+        return self.max
+
+    def as_dict(self, digits: int = 3) -> dict:
+        def round_(value):
+            return round(value, digits) if value is not None else None
+
+        return {
+            'count': self.count,
+            'min': round_(self.min),
+            'avg': round_(self.total / self.count) if self.count else None,
+            'p50': round_(self.percentile(50)),
+            'p90': round_(self.percentile(90)),
+            'p99': round_(self.percentile(99)),
+            'max': round_(self.max),
+        }
@@ -0,0 +1,66 @@
+from __future__ import annotations
+import math
+import time
+from collections.abc import Callable
+
+
+class Timer:
+    __slots__ = ('tick', 'callback', 'args')
+
+    def __init__(self, tick: int, callback: Callable, args: tuple):
+        self.tick = tick
+        self.callback = callback
+        self.args = args
+
+    def __repr__(self):
+        return f"Timer(tick={self.tick}, callback={self.callback})"
+
+
+class TimerWheel:
+    def __init__(self, resolution: float = 0.5, slots: int = 256,
+                 clock: Callable[[], float] = time.monotonic):
+        self.resolution = resolution
+        self.clock = clock
+
+        # hashed wheel, timers further out than one turn share a slot with
+        # nearer ones and are skipped until their tick comes round
+        self.slots: list[set[Timer]] = [set() for _ in range(slots)]
+        self.tick = self.now()
+
+    def pending(self) -> int:
+        return sum(len(slot) for slot in self.slots)
+
+    def now(self) -> int:
+        return int(self.clock() / self.resolution)
+
+    def schedule(self, delay: float, callback: Callable, *args) -> Timer:
+        ticks = max(math.ceil(delay / self.resolution), 1)
+        timer = Timer(self.now() + ticks, callback, args)
+        self.slots[timer.tick % len(self.slots)].add(timer)
+        return timer
+
+    def cancel(self, timer: Timer):
+        if timer is not None:
+            self.slots[timer.tick % len(self.slots)].discard(timer)
+
+    def reschedule(self, timer: Timer, delay: float) -> Timer:
+        self.cancel(timer)
+        return self.schedule(delay, timer.callback, *timer.args)
+
+    def advance(self) -> int:
+        # a late call still visits every slot at most once
+        now = self.now()
+        size = len(self.slots)
+
+        due = []
+        for tick in range(max(self.tick + 1, now - size + 1), now + 1):
+            slot = self.slots[tick % size]
+            for timer in [t for t in slot if t.tick <= now]:
+                slot.remove(timer)
+                due.append(timer)
+        self.tick = now
+
+        due.sort(key=lambda t: t.tick)
+        for timer in due:
+            timer.callback(*timer.args)
+        return len(due)
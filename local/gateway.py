@@ -0,0 +1,280 @@
+#!/usr/bin/env python3
+"""Serves the handlers over HTTP from one long-lived process.
+
+A local stand-in for API Gateway and Lambda: every route of template.yaml
+is answered by the same handler module, loaded once and kept warm, and
+run on a thread pool so the blocking clients don't stall the event loop.
+Identical checks that arrive while one is in flight share its response,
+and no game server is probed by more than a few checks at once:
+
+    python local/gateway.py --port 3000
+    curl -d '{"host": "127.0.0.1", "port": 27888}' \\
+        localhost:3000/kaillera/server-check
+"""
+
+import argparse
+import asyncio
+import importlib.util
+import json
+import os
+import sys
+import time
+from concurrent.futures import ThreadPoolExecutor
+from http import HTTPStatus
+from urllib.parse import parse_qsl, urlsplit
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+LAYER = os.path.join(ROOT, 'lib', 'python')
+sys.path.insert(0, LAYER)
+
+from singleflight import KeyedLimiter, SingleFlight  # noqa: E402
+
+# path -> (handler, method), as routed by template.yaml
+ROUTES = {
+    '/kaillera/get-ip': ('get-ip', 'GET'),
+    '/kaillera/p2p-check': ('p2p-check', 'POST'),
+    '/kaillera/server-check': ('server-check', 'POST'),
+}
+
+CORS = {
+    'Access-Control-Allow-Headers': 'Content-Type',
+    'Access-Control-Allow-Origin': '*',
+    'Access-Control-Allow-Methods': 'OPTIONS,POST,GET',
+}
+
+MAX_BODY = 1 << 16
+MAX_HEADERS = 64
+
+
+def load_handler(name: str):
+    # every handler is a module called app, each gets its own name here
+    path = os.path.join(ROOT, name, 'src', 'app.py')
+    spec = importlib.util.spec_from_file_location(
+        name.replace('-', '_') + '_app', path)
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return module
+
+
+class Context:
+    def __init__(self, function_name: str, timeout: float):
+        self.function_name = function_name
+        self.expires = time.monotonic() + timeout
+
+    def get_remaining_time_in_millis(self) -> int:
+        return max(int((self.expires - time.monotonic()) * 1000), 0)
+
+
+def probes(handler: str, event: dict) -> tuple[tuple, list]:
+    # the game servers a request is going to probe and what makes two
+    # requests the same check, nothing when it won't probe any or is too
+    # broken to tell
+    try:
+        body = json.loads(event['body'])
+        if handler == 'server-check':
+            batch = 'hosts' in body
+            targets = [(h['host'], int(h['port']))
+                       for h in (body['hosts'] if batch else [body])]
+            return (handler, batch, tuple(targets)), targets
+        elif handler == 'p2p-check':
+            caller = event['headers'].get(os.environ['PROXY_HEADER'])
+            host = caller if body['host'] == 'self' else body['host']
+            targets = [(host, int(body.get('port', 27886)))]
+            return (handler, tuple(targets)), targets
+    except (KeyError, TypeError, ValueError, AttributeError):
+        pass
+    return None, None
+
+
+class Gateway:
+    def __init__(self, handlers: list[str] = None, workers: int = 32,
+                 per_target: int = 2, timeout: float = 7,
+                 trust_proxy: bool = False):
+        self.handlers = {name: load_handler(name) for name in
+                         handlers or sorted({h for h, _ in ROUTES.values()})}
+        self.timeout = timeout
+        self.trust_proxy = trust_proxy
+
+        self.executor = ThreadPoolExecutor(max_workers=workers)
+        self.flights = SingleFlight()
+        self.limiter = KeyedLimiter(per_target)
+
+    def close(self):
+        self.executor.shutdown(wait=False)
+
+    async def invoke(self, handler: str, event: dict) -> dict:
+        loop = asyncio.get_running_loop()
+        context = Context(handler, self.timeout)
+        module = self.handlers[handler]
+        return await loop.run_in_executor(
+            self.executor, module.lambda_handler, event, context)
+
+    async def check(self, handler: str, event: dict) -> tuple[dict, bool]:
+        key, targets = probes(handler, event)
+        if not targets:
+            return await self.invoke(handler, event), False
+
+        async def limited():
+            async with self.limiter.hold(targets):
+                return await self.invoke(handler, event)
+
+        # the same check of the same servers is the same answer, whoever
+        # asked for it
+        shared = key in self.flights
+        return await self.flights.do(key, limited), shared
+
+    async def respond(self, method: str, target: str, headers: dict,
+                      body: bytes, peer: str) -> tuple[int, dict, bytes, bool]:
+        url = urlsplit(target)
+        route = ROUTES.get(url.path.rstrip('/'))
+        if route is None or route[0] not in self.handlers:
+            return 404, {}, b'{"message": "Not Found"}', False
+        if method == 'OPTIONS':
+            return 204, dict(CORS), b'', False
+
+        handler, allowed = route
+        if method != allowed:
+            return 405, {'Allow': allowed}, \
+                b'{"message": "Method Not Allowed"}', False
+
+        # stands in for the cdn in front, which sets the caller's address
+        proxy_header = os.environ['PROXY_HEADER']
+        if not self.trust_proxy or proxy_header not in headers:
+            headers[proxy_header] = peer
+
+        event = {
+            'resource': url.path,
+            'path': url.path,
+            'httpMethod': method,
+            'headers': headers,
+            'queryStringParameters': dict(parse_qsl(url.query)) or None,
+            'body': body.decode(errors='replace'),
+            'isBase64Encoded': False,
+        }
+
+        try:
+            response, shared = await asyncio.wait_for(
+                self.check(handler, event), self.timeout + 1)
+        except asyncio.TimeoutError:
+            return 504, {}, b'{"message": "Endpoint request timed out"}', \
+                False
+        except Exception:
+            return 502, {}, b'{"message": "Internal server error"}', False
+
+        payload = response.get('body') or ''
+        return response.get('statusCode', 200), \
+            response.get('headers') or {}, payload.encode(), shared
+
+    async def serve_client(self, reader: asyncio.StreamReader,
+                           writer: asyncio.StreamWriter):
+        peer = (writer.get_extra_info('peername') or ('unknown',))[0]
+        try:
+            while True:
+                request = await read_request(reader)
+                if request is None:
+                    break
+
+                start = time.perf_counter()
+                method, target, version, headers, body = request
+                status, response_headers, payload, shared = \
+                    await self.respond(method, target, headers, body, peer)
+
+                keep_alive = version == 'HTTP/1.1' and \
+                    headers.get('connection', '').lower() != 'close'
+                writer.write(encode_response(status, response_headers,
+                                             payload, keep_alive))
+                await writer.drain()
+
+                print(json.dumps({
+                    'method': method, 'path': target, 'status': status,
+                    'ms': round((time.perf_counter() - start) * 1000, 3),
+                    'shared': shared,
+                }), flush=True)
+                if not keep_alive:
+                    break
+        except ValueError:
+            writer.write(encode_response(400, {}, b'', False))
+        except (ConnectionError, asyncio.IncompleteReadError):
+            pass
+        finally:
+            writer.close()
+
+
+async def read_request(reader: asyncio.StreamReader) -> tuple:
+    line = await reader.readline()
+    if not line.strip():
+        return None
+
+    method, target, version = line.decode('latin-1').split()
+    headers = {}
+    while True:
+        line = await reader.readline()
+        if line in (b'\r\n', b'\n'):
+            break
+        if not line or len(headers) >= MAX_HEADERS:
+            raise ValueError("bad headers")
+
+        name, _, value = line.decode('latin-1').partition(':')
+        headers[name.strip().lower()] = value.strip()
+
+    length = int(headers.get('content-length', 0))
+    if not 0 <= length <= MAX_BODY:
+        raise ValueError(f"body of {length} bytes")
+    body = await reader.readexactly(length)
+    return method.upper(), target, version.upper(), headers, body
+
+
+def encode_response(status: int, headers: dict, body: bytes,
+                    keep_alive: bool) -> bytes:
+    lines = [f'HTTP/1.1 {status} {HTTPStatus(status).phrase}']
+    headers = dict({'Content-Type': 'application/json'}, **headers)
+    headers['Content-Length'] = str(len(body))
+    headers['Connection'] = 'keep-alive' if keep_alive else 'close'
+    lines += [f'{name}: {value}' for name, value in headers.items()]
+    return '\r\n'.join(lines).encode('latin-1') + b'\r\n\r\n' + body
+
+
+async def serve(args: argparse.Namespace):
+    gateway = Gateway(args.handlers, args.workers, args.per_target,
+                      args.timeout, args.trust_proxy)
+    server = await asyncio.start_server(gateway.serve_client, args.host,
+                                        args.port)
+    print(f"serving {', '.join(gateway.handlers)} on "
+          f"http://{args.host}:{args.port}", flush=True)
+    try:
+        async with server:
+            await server.serve_forever()
+    finally:
+        gateway.close()
+
+
+def main(argv: list[str] = None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=3000)
+    parser.add_argument('--workers', type=int, default=32,
+                        help="handler invocations running at once")
+    parser.add_argument('--per-target', type=int, default=2,
+                        help="checks probing one game server at once")
+    parser.add_argument('--timeout', type=float, default=7,
+                        help="seconds each invocation gets, as in lambda")
+    parser.add_argument('--trust-proxy', action='store_true',
+                        help="keep a caller address set by a proxy in front")
+    parser.add_argument('handlers', nargs='*', default=None)
+    args = parser.parse_args(argv)
+
+    # headers arrive lower cased, like api gateway's http apis pass them
+    os.environ['PROXY_HEADER'] = os.environ.get(
+        'PROXY_HEADER', 'cf-connecting-ip').lower()
+    # a handler's metrics belong to the one invocation lambda runs at a
+    # time, threads sharing them would flush each other's counts and hosts,
+    # the request log above stands in for them
+    os.environ['METRICS_SINK'] = 'none'
+    try:
+        asyncio.run(serve(args))
+    except KeyboardInterrupt:
+        pass
+
+
+if __name__ == '__main__':
+    main()
@@ -5,15 +5,29 @@ import os
 import socket
 
 import kaillera.p2pclient as Kaillera
+import metrics
+from cache import TTLCache
+from deadline import Deadline
+from sockets import SocketPool
+
+# lives as long as the container, so warm invocations share results
+CACHE = TTLCache.from_env()
+POOL = SocketPool()
+METRICS = metrics.from_env()
 
 
-# FIXME: the number of messages is limited until PING is implemented
 def bot_message_en(user: str, host: str, port: int,
-                   check_from: str, check_via: str):
+                   check_from: str, check_via: str, ping: dict = None):
+    latency = []
+    if ping and ping['received']:
+        latency = [f"Ping from the checker was {round(ping['avg'])} ms "
+                   f"with {ping['loss']} of {ping['sent']} probes lost.\n"]
+
     return [
         f'\n',
         f"Hey {user}! Your P2P is WORKING CORRECTLY!",
         f"Just share '{host}:{port}' with your opponent to play.\n",
+        *latency,
         f'Remember to only share your IP with people you trust.',
         f'This bot request came from {check_from} via {check_via}.',
         f'If you did not ask for this check, please report it in Discord.\n',
@@ -37,7 +51,23 @@ def respond(http_code: int, success: bool, message: str, meta: dict = {}):
     }
 
 
+def respond_cached(key: tuple, success: bool, message: str, meta: dict):
+    CACHE.set(key, (success, message, meta), success)
+    METRICS.put('success', success)
+    return respond(200, success, message, dict(meta, cached=False))
+
+
 def lambda_handler(event, context):
+    try:
+        with METRICS.timer('invocation_ms'):
+            return check(event, context)
+    finally:
+        METRICS.flush({'Function': 'p2p-check'})
+
+
+def check(event, context):
+    deadline = Deadline.from_context(context)
+
     try:
         body = json.loads(event['body'])
         header = os.environ['PROXY_HEADER']
@@ -48,8 +78,18 @@ def lambda_handler(event, context):
         host = check_from if body['host'] == 'self' else body['host']
 
         meta = {'host': host, 'port': port}
-
-        client = Kaillera.P2PClient(host, port)
+        METRICS.put('host', host)
+        METRICS.put('port', port)
+
+        key = (host, port, 'p2p-check')
+        cached = CACHE.get(key)
+        if cached is not None:
+            METRICS.incr('cache_hits')
+            success, message, cached_meta = cached
+            return respond(200, success, message,
+                           dict(cached_meta, cached=True))
+
+        client = Kaillera.P2PClient(host, port, pool=POOL, metrics=METRICS)
     except socket.error:
         return respond(400, False, "Unable to connect", meta)
     except Exception as e:
@@ -58,22 +98,40 @@ def lambda_handler(event, context):
     try:
         username = 'smash64.online'
         client_name = 'p2p-checker-bot'
-        connect, response = client.connect(username, client_name)
+        # connecting is what the check is about, chat gets what is left
+        connect, response = client.connect(username, client_name,
+                                           deadline=deadline.share(0.75))
 
         if connect is True:
             user, game = client.get_host_info(response)
             meta['user'] = user
             meta['game'] = game
 
-            message = bot_message_en(user, host, port, check_from, check_via)
-
-            for id, line in enumerate(message):
-                wait = True if id == 0 else False
-                client.chat(line, wait=wait)
-            client.disconnect()
-
-            return respond(200, True, "OK", meta)
+            # the host echoes probes on the same connection, so the user
+            # learns the latency to expect without a second round
+            try:
+                meta['ping'] = client.ping(5, deadline=deadline.share(0.5)
+                                           ).as_dict()
+            except socket.error:
+                pass
+
+            message = bot_message_en(user, host, port, check_from, check_via,
+                                     meta.get('ping'))
+
+            try:
+                # all lines go out together in a single datagram
+                client.chat_many(message, deadline=deadline)
+            except socket.timeout:
+                meta['partial'] = True
+            finally:
+                # the bot leaves the host's game whether or not it got
+                # everything said
+                client.disconnect()
+
+            return respond_cached(key, True, "OK", meta)
         else:
-            return respond(200, False, "Unable to connect", meta)
+            return respond_cached(key, False, "Unable to connect", meta)
     except Exception as e:
-        return respond(200, False, "Unable to connect", meta)
+        return respond_cached(key, False, "Unable to connect", meta)
+    finally:
+        client.close()
@@ -3,9 +3,21 @@
 import json
 import socket
 import kaillera.client as Kaillera
+import metrics
+from cache import TTLCache
+from deadline import Deadline
+from sockets import SocketPool
 
 
-def respond(http_code: int, success: bool, message: str):
+BATCH_LIMIT = 64
+
+# lives as long as the container, so warm invocations share results
+CACHE = TTLCache.from_env()
+POOL = SocketPool()
+METRICS = metrics.from_env()
+
+
+def respond(http_code: int, success: bool, message: str, meta: dict = {}):
     return {
         "statusCode": http_code,
         'headers': {
@@ -15,23 +27,144 @@ def respond(http_code: int, success: bool, message: str):
         },
         "body": json.dumps({
             "message": message,
+            "meta": json.dumps(meta),
             "success": success,
         }),
     }
 
 
+def cache_key(host: str, port: int) -> tuple[str, int, str]:
+    return host, port, 'server-check'
+
+
+def cache_result(result: dict) -> dict:
+    CACHE.set(cache_key(result['host'], result['port']), result,
+              result['success'])
+    return dict(result, cached=False)
+
+
+async def probe(host: str, port: int, deadline: Deadline) -> dict:
+    import kaillera.asyncclient as AsyncKaillera
+
+    result = {'host': host, 'port': port}
+    client = AsyncKaillera.AsyncClient(host, port)
+    try:
+        stats = await client.ping_stats(3, deadline=deadline)
+        if not stats.received:
+            raise socket.timeout
+
+        result.update({'success': True, 'latency': int(stats.avg),
+                       'loss': stats.lost, 'ping': stats.as_dict()})
+    except Exception:
+        result.update({'success': False, 'error': "Unable to connect"})
+    finally:
+        client.close()
+    return cache_result(result)
+
+
+def probe_all(targets: list[tuple[str, int]],
+              deadline: Deadline) -> list[dict]:
+    # asyncio alone costs more to import than the rest of the handler, so
+    # it is only loaded by requests that actually probe in batches
+    import asyncio
+
+    async def gather() -> list[dict]:
+        # hits are kept, an entry expiring while the probes run is still
+        # the answer it was when the batch came in
+        hits, tasks = {}, {}
+        for host, port in targets:
+            hit = CACHE.get(cache_key(host, port))
+            if hit is not None:
+                hits[host, port] = hit
+            elif (host, port) not in tasks:
+                tasks[host, port] = asyncio.ensure_future(
+                    probe(host, port, deadline))
+
+        if tasks:
+            await asyncio.wait(tasks.values(), timeout=deadline.remaining())
+
+        results = []
+        for host, port in targets:
+            task = tasks.get((host, port))
+            if task is None:
+                results.append(dict(hits[host, port], cached=True))
+            elif task.done():
+                results.append(task.result())
+            else:
+                task.cancel()
+                results.append({'host': host, 'port': port,
+                                'success': False, 'error': "Timed out",
+                                'cached': False})
+        return results
+
+    return asyncio.run(gather())
+
+
+def batch_handler(hosts: list, deadline: Deadline):
+    try:
+        targets = [(h['host'], int(h['port'])) for h in hosts]
+        if not targets or len(targets) > BATCH_LIMIT:
+            raise ValueError(len(targets))
+    except Exception:
+        return respond(400, False, "Invalid parameters")
+
+    results = probe_all(targets, deadline)
+    success = any(r['success'] for r in results)
+    return respond(200, success, "OK", {'servers': results})
+
+
+def respond_result(result: dict):
+    if not result['success']:
+        return respond(200, False, result['error'],
+                       {'cached': result['cached']})
+
+    meta = dict(result['ping'], cached=result['cached'])
+    return respond(200, True, f"{result['latency']}ms", meta)
+
+
 def lambda_handler(event, context):
+    try:
+        with METRICS.timer('invocation_ms'):
+            return check(event, context)
+    finally:
+        METRICS.flush({'Function': 'server-check'})
+
+
+def check(event, context):
+    deadline = Deadline.from_context(context)
+
     try:
         body = json.loads(event['body'])
-        client = Kaillera.Client(body['host'], int(body['port']))
+        if 'hosts' in body:
+            return batch_handler(body['hosts'], deadline)
+
+        host, port = body['host'], int(body['port'])
+        METRICS.put('host', host)
+        METRICS.put('port', port)
+
+        result = CACHE.get(cache_key(host, port))
+        if result is not None:
+            METRICS.incr('cache_hits')
+            return respond_result(dict(result, cached=True))
+
+        client = Kaillera.Client(host, port, pool=POOL, metrics=METRICS)
     except socket.error:
         return respond(400, False, "Unable to connect")
     except Exception:
         return respond(400, False, "Invalid parameters")
 
+    result = {'host': host, 'port': port}
     try:
-        latency, drops = client.ping(3)
+        stats = client.ping_stats(3, deadline=deadline)
+        if not stats.received:
+            raise socket.timeout
+
+        result.update({'success': True, 'latency': int(stats.avg),
+                       'loss': stats.lost, 'ping': stats.as_dict()})
     except Exception as e:
-        return respond(200, False, "Unable to connect")
+        result.update({'success': False, 'error': "Unable to connect"})
+    finally:
+        client.close()
 
-    return respond(200, True, f"{latency}ms")
+    METRICS.put('success', result['success'])
+    return respond_result(cache_result(result))
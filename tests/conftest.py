@@ -0,0 +1,7 @@
+import os
+import sys
+
+# the handlers find the layer under /opt/python on lambda, here it is put
+# on the path the same way local/gateway.py does
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, os.path.join(ROOT, 'lib', 'python'))
@@ -0,0 +1,81 @@
+import importlib.util
+import os
+
+import pytest
+
+from cache import TTLCache
+from deadline import Deadline
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+class Clock:
+    def __init__(self):
+        self.now = 0.0
+
+    def __call__(self) -> float:
+        return self.now
+
+
+@pytest.fixture
+def clock():
+    return Clock()
+
+
+def load_handler(name: str):
+    # every handler is a module called app, each gets its own name here
+    path = os.path.join(ROOT, name, 'src', 'app.py')
+    spec = importlib.util.spec_from_file_location(
+        name.replace('-', '_') + '_app', path)
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return module
+
+
+def test_entries_expire_by_outcome(clock):
+    cache = TTLCache(ttl=30, negative_ttl=5, clock=clock)
+    cache.set('up', 1)
+    cache.set('down', 0, success=False)
+
+    clock.now = 10
+    assert cache.get('up') == 1
+    assert cache.get('down') is None
+    assert len(cache) == 1
+
+
+def test_least_recently_used_goes_first(clock):
+    cache = TTLCache(maxsize=2, clock=clock)
+    cache.set('a', 1)
+    cache.set('b', 2)
+    cache.get('a')
+    cache.set('c', 3)
+
+    assert 'a' in cache and 'c' in cache and 'b' not in cache
+
+
+def test_zero_ttl_stores_nothing(clock):
+    cache = TTLCache(ttl=0, clock=clock)
+    cache.set('a', 1)
+    assert len(cache) == 0
+
+
+def test_batch_survives_an_entry_expiring_mid_probe(clock, monkeypatch):
+    app = load_handler('server-check')
+    monkeypatch.setattr(app, 'CACHE', TTLCache(negative_ttl=0.5,
+                                               clock=clock))
+    app.cache_result({'host': 'cached', 'port': 1, 'success': False,
+                      'error': "Unable to connect"})
+
+    async def probe(host, port, deadline):
+        # the cached entry expires while this one is being probed
+        clock.now += 1
+        return app.cache_result({'host': host, 'port': port,
+                                 'success': True})
+    monkeypatch.setattr(app, 'probe', probe)
+
+    results = app.probe_all([('cached', 1), ('fresh', 2), ('cached', 1)],
+                            Deadline(2))
+
+    assert [(r['host'], r['cached']) for r in results] == [
+        ('cached', True), ('fresh', False), ('cached', True)]
+    assert app.CACHE.get(('cached', 1, 'server-check')) is None
@@ -0,0 +1,95 @@
+from message import MessageBuffer
+
+from kaillera.models import KailleraMessage, MessageType, P2PMessage, P2PType
+
+
+def chat(text: str = 'hi') -> KailleraMessage:
+    return KailleraMessage(type_=MessageType.CHAT_GLOBAL,
+                           data=text.encode() + b'\0')
+
+
+def p2p_chat(text: str = 'hi') -> P2PMessage:
+    return P2PMessage(type_=P2PType.PLAYER_CHAT, data=text.encode() + b'\0')
+
+
+def test_kaillera_ids_wrap_at_16_bits():
+    buffer = MessageBuffer(manage=True, as_=KailleraMessage, window=5)
+    buffer.last_id = 0xfffe
+
+    assert [buffer.add(chat()) for _ in range(3)] == [0xffff, 0, 1]
+    assert [m.id for m in buffer] == [1, 0, 0xffff]
+
+
+def test_p2p_ids_wrap_at_8_bits():
+    buffer = MessageBuffer(manage=True, as_=P2PMessage, meta_size=2,
+                           window=32)
+    ids = [buffer.add(p2p_chat()) for _ in range(258)]
+
+    assert ids[255:] == [255, 0, 1]
+    assert [m.id for m in buffer][:3] == [1, 0, 255]
+
+
+def test_window_evicts_oldest():
+    buffer = MessageBuffer(manage=True, as_=KailleraMessage, window=3)
+    for i in range(5):
+        buffer.add(chat(str(i)))
+
+    assert [m.id for m in buffer] == [4, 3, 2]
+    # the wire bytes go with the message, nothing else is kept around
+    assert sorted(buffer.encoded) == [2, 3, 4]
+
+
+def test_window_holds_across_wraparound():
+    buffer = MessageBuffer(manage=True, as_=P2PMessage, meta_size=2,
+                           window=4)
+    for i in range(600):
+        buffer.add(p2p_chat(str(i)))
+
+    assert len(buffer) == 4 and len(buffer.encoded) == 4
+    assert [m.id for m in buffer] == [599 % 256, 598 % 256, 597 % 256,
+                                      596 % 256]
+    assert [m.data for m in buffer][0] == b'599\0'
+
+
+def test_unbounded_buffer_replaces_a_wrapped_id():
+    buffer = MessageBuffer(manage=True, as_=P2PMessage, meta_size=2)
+    for i in range(257):
+        buffer.add(p2p_chat(str(i)))
+
+    # id 0 was taken again by the 257th message, the newest one wins
+    assert len(buffer) == 256
+    assert next(iter(buffer)).data == b'256\0'
+
+
+def test_received_duplicates_are_dropped():
+    buffer = MessageBuffer(as_=KailleraMessage, window=64)
+    message = chat()
+    message.id = 7
+
+    again = chat('again')
+    again.id = 7
+
+    assert buffer.add(message) == 7
+    assert buffer.add(again) == 7
+    assert len(buffer) == 1 and next(iter(buffer)).data == b'hi\0'
+
+
+def test_encode_sends_newest_first_and_decodes_back():
+    sender = MessageBuffer(manage=True, as_=KailleraMessage, window=32)
+    for i in range(8):
+        sender.add(chat(str(i)))
+
+    received = MessageBuffer(sender.encode(), as_=KailleraMessage)
+    assert [m.id for m in received] == [7, 6, 5, 4, 3]
+    assert [m.data for m in received][0] == b'7\0'
+
+
+def test_decode_all_merges_overlapping_windows():
+    sender = MessageBuffer(manage=True, as_=KailleraMessage, window=32)
+    datagrams = []
+    for i in range(4):
+        sender.add(chat(str(i)))
+        datagrams.append(sender.encode())
+
+    merged = MessageBuffer.decode_all(datagrams, as_=KailleraMessage)
+    assert [m.id for m in merged] == [3, 2, 1, 0]
@@ -0,0 +1,127 @@
+import socket
+import threading
+import time
+
+import pytest
+
+from rto import RTOEstimator
+
+from kaillera.models import P2PClientExit
+from kaillera.p2pclient import P2PClient
+
+
+def test_first_sample_sets_srtt_and_rttvar():
+    rto = RTOEstimator()
+    rto.sample(0.1)
+
+    assert rto.srtt == 0.1 and rto.rttvar == 0.05
+    # srtt + 4 * rttvar, as RFC 6298 has it
+    assert rto.rto == pytest.approx(0.3)
+
+
+def test_samples_are_smoothed():
+    rto = RTOEstimator()
+    rto.sample(0.1)
+    rto.sample(0.2)
+
+    assert rto.rttvar == pytest.approx(0.75 * 0.05 + 0.25 * 0.1)
+    assert rto.srtt == pytest.approx(0.875 * 0.1 + 0.125 * 0.2)
+
+
+def test_rto_is_clamped():
+    rto = RTOEstimator(min_rto=0.2, max_rto=2)
+    rto.sample(0.001)
+    assert rto.rto == 0.2
+
+    rto.sample(10)
+    assert rto.rto == 2
+
+
+def test_backoff_doubles_up_to_max():
+    rto = RTOEstimator(initial=0.5, max_rto=3)
+    rto.backoff()
+    assert rto.rto == 1
+    rto.backoff()
+    rto.backoff()
+    assert rto.rto == 3
+
+
+class Peer:
+    # answers every datagram with an empty P2P bundle, after ignoring the
+    # first `ignore` of them
+    def __init__(self, ignore: int = 0):
+        self.ignore = ignore
+        self.received = 0
+        self.sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        self.sock.bind(('127.0.0.1', 0))
+        self.sock.settimeout(0.1)
+        self.running = True
+        self.thread = threading.Thread(target=self.serve, daemon=True)
+        self.thread.start()
+
+    @property
+    def port(self) -> int:
+        return self.sock.getsockname()[1]
+
+    def serve(self):
+        while self.running:
+            try:
+                _, addr = self.sock.recvfrom(65535)
+            except socket.timeout:
+                continue
+            self.received += 1
+            if self.received > self.ignore:
+                self.sock.sendto(b'\0', addr)
+
+    def close(self):
+        self.running = False
+        self.thread.join()
+        self.sock.close()
+
+
+@pytest.fixture
+def peer(request):
+    peer = Peer(getattr(request, 'param', 0))
+    yield peer
+    peer.close()
+
+
+def test_answered_exchange_is_sampled(peer):
+    client = P2PClient('127.0.0.1', peer.port, timeout=2)
+    try:
+        client.send_message(P2PClientExit())
+    finally:
+        client.close()
+
+    assert client.rto.srtt is not None
+
+
+@pytest.mark.parametrize('peer', [1], indirect=True)
+def test_karn_skips_retransmitted_exchange(peer):
+    client = P2PClient('127.0.0.1', peer.port, retry=3, timeout=2)
+    try:
+        client.send_message(P2PClientExit())
+    finally:
+        client.close()
+
+    # the reply may answer either copy, so it says nothing about the rtt
+    assert peer.received == 2
+    assert client.rto.srtt is None
+    # the backoff from the lost first copy is kept
+    assert client.rto.rto == pytest.approx(2 * 2 / 4)
+
+
+@pytest.mark.parametrize('peer', [100], indirect=True)
+def test_retransmissions_stay_within_timeout(peer):
+    client = P2PClient('127.0.0.1', peer.port, retry=3, timeout=0.8)
+    start = time.monotonic()
+    try:
+        with pytest.raises(socket.timeout):
+            client.send_message(P2PClientExit())
+    finally:
+        client.close()
+
+    assert time.monotonic() - start < 0.8 + 0.1
+    # rtos of 0.2 and 0.4 leave 0.2 for the third copy's wait, the budget
+    # is gone before a fourth one could go out
+    assert peer.received == 3